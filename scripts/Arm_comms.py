@@ -3,6 +3,13 @@ from os import system, name
 
 from sockets_TFM import *
 from comRT3_TFM import *
+from move_protocol import MovePlanClient, pick_and_place
+from instrumentation import metrics
+
+#Example move in robot coordinates (mm): grasp pose of the source and destination square
+SOURCE_POSE = (300.0, -100.0, 20.0)
+DESTINATION_POSE = (300.0, 0.0, 20.0)
+SAFE_Z = 120.0
 
 print("\n----------CONNECTION PARAMETERS-----------\n")
 SockData.IP = "192.168.100.115"
@@ -16,21 +23,31 @@ print("\n")
 destSocket = CreateSocket(SockData)     #Communication for vision and playing data
 RT3_address, commands, RT3_sock = initRT3COM(SockData)      #Communciation for RT3 Commands
 
-initRobot(RT3_sock, RT3_address, commands)      #Initialize Robot configuration
-time.sleep(0.5)
+#Time every start step, the fixed sleeps of comRT3_TFM are included
+with metrics.span("rt3_init"):
+    initRobot(RT3_sock, RT3_address, commands)      #Initialize Robot configuration
+    time.sleep(0.5)
 
 #Load MAIN Program and start the application
-loadProgram(RT3_sock, RT3_address, commands, "TEST")
+with metrics.span("rt3_load"):
+    loadProgram(RT3_sock, RT3_address, commands, "TEST")
 
 print("Program Loaded")
 
 #Run the Robot
-runRobot(RT3_sock, RT3_address, commands)
+with metrics.span("rt3_run"):
+    runRobot(RT3_sock, RT3_address, commands)
 robotCOM, robotIP = ConnectRobot(destSocket)
 
 print("Waiting the robot...\n")
 
-DataTransmission(SockData,robotCOM,SockData.Port.encode('utf-8'))
+#Send the whole pick-and-place sequence in one frame and wait until it was executed
+planClient = MovePlanClient(robotCOM)
+seq = planClient.execute(pick_and_place(SOURCE_POSE, DESTINATION_POSE, SAFE_Z))
+print("Move plan %i done" % seq)
+
 closeCOM(RT3_address, RT3_sock,commands)
 
+print(metrics.report())
+
 sys.exit()
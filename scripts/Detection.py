@@ -1,105 +1,167 @@
 import cv2
-from inference.models.utils import get_roboflow_model
-from inference.core.nms import w_np_non_max_suppression
 import supervision as sv
-import json
+import os
 import time
+import argparse
 
-# Load the model
-model = get_roboflow_model(model_id="chess-piece-detection-dwh0r/1", api_key="oJrlpFzFT49RMEIXZJoN")
+from frame_ring import FrameRing
+from change_gate import ChangeGate
+from tile_classifier import TileClassifier, tile_predictions
+from inference_backends import load_backend
+from postprocess import response_to_arrays, postprocess, records_xyxy
+from state_format import write_detections, DETECTIONS_PATH
+from visualizer import create_visualizer, add_visualizer_arguments
+from instrumentation import metrics, add_metrics_arguments, configure_metrics
+
+# Model settings, "roboflow" needs ROBOFLOW_API_KEY in the environment, "onnx" runs the exported weights offline
+PIECE_MODEL_ID = "chess-piece-detection-dwh0r/1"
+INFERENCE_BACKEND = os.environ.get("CHESS_INFERENCE_BACKEND", "roboflow")
+ONNX_THREADS = int(os.environ.get("CHESS_ONNX_THREADS", "0"))  # 0 lets ONNX Runtime use all cores
+
+# Detection mode: "board" runs the full-frame detector, "tiles" classifies the 64 square tiles
+DETECTION_MODE = "board"
+TILE_MODEL_PATH = "../models/tile_classifier.onnx"
 
 # Define NMS parameters
 conf_thresh = 0.50  # Confidence threshold
 iou_thresh = 0.50   # IOU threshold
 max_detections = 32 # Maximum number of detections
 
-# Define a loop for continuous inference
-while True:
-    try:
-        # Read the image
-        image = cv2.imread("../saved_files/board.png")
-        # Resizing is very important dont comment this
-        image = cv2.resize(image, (680, 680))
+# Function to load a model (piece detection by default) on the configured backend
+def load_model(model_id=PIECE_MODEL_ID, backend=None, threads=None):
+    backend = backend or INFERENCE_BACKEND
+    if backend == "onnx":
+        return load_backend(model_id, "onnx", conf_thresh=conf_thresh, iou_thresh=iou_thresh,
+                            max_detections=max_detections,
+                            intra_threads=ONNX_THREADS if threads is None else threads)
+    return load_backend(model_id, backend)
+
+# Function to build the supervision detections used for drawing from detection records
+def records_to_detections(records):
+    return sv.Detections(xyxy=records_xyxy(records).reshape(-1, 4),
+                         confidence=records["confidence"],
+                         class_id=records["piece"].astype(int))
+
+# Function to bring a warped board to the detector input size
+def resize_board(image):
+    # Resizing is very important dont comment this (frames from the ring already have the right size)
+    return image if image.shape[:2] == (680, 680) else cv2.resize(image, (680, 680))
 
-        # Perform inference on the image
+# Function to turn one model response into DETECTION_DTYPE records
+def postprocess_response(response, frame_id=None):
+    # Confidence filter, per-class centroid offsets, NMS and top-k on arrays
+    with metrics.span("postprocess", frame_id):
+        xywh, piece, confidence = response_to_arrays(response)
+        return postprocess(xywh, piece, confidence, conf_thresh, iou_thresh, max_detections=max_detections)
+
+# Function to run the piece detector on a warped board image, returns DETECTION_DTYPE records
+def detect_pieces(model, image, frame_id=None):
+    image = resize_board(image)
+
+    # Perform inference on the image
+    with metrics.span("piece_inference", frame_id):
         results = model.infer(image)[0]
-        # print (results)
-        detections = sv.Detections.from_inference(results)
-        # detections_nms = sv.Detections.with_nms(detections,threshold=0.75, class_agnostic=True)
-
-        annotated_image = sv.BoundingBoxAnnotator().annotate(scene=image, detections=detections)
-
-        # Convert detections to JSON format
-        predictions_data = []
-        object_count = 0
-        existing_predictions = []
-        for prediction in results.predictions:
-            if( prediction.class_name == "3" or prediction.class_name == "9" or prediction.class_name == "4" or prediction.class_name == "10" or prediction.class_name == "1" or prediction.class_name == "7"):
-                prediction_dict = {
-                    "detection_id": prediction.detection_id,
-                    "class_name": prediction.class_name,
-                    "class_id": prediction.class_id,
-                    "bounding_box": {
-                        "x": prediction.x,
-                        "y": prediction.y + 15,
-                        "width": prediction.width,
-                        "height": prediction.height
-                    },
-                    "confidence": prediction.confidence
-                }
-            elif(prediction.class_name == "2" or prediction.class_name == "5" or prediction.class_name == "8" or prediction.class_name == "11"):
-                prediction_dict = {
-                    "detection_id": prediction.detection_id,
-                    "class_name": prediction.class_name,
-                    "class_id": prediction.class_id,
-                    "bounding_box": {
-                        "x": prediction.x,
-                        "y": prediction.y + 25,
-                        "width": prediction.width,
-                        "height": prediction.height
-                    },
-                    "confidence": prediction.confidence
-                }
+
+    records = postprocess_response(results, frame_id)
+    return records, image, records_to_detections(records)
+
+# Function to run the piece detector on several warped boards in one batched call, returns one records array per board
+# With a cpu_pool.CpuPool the resizing of the boards runs in parallel, post-processing stays inline (it holds the GIL)
+def detect_pieces_batch(model, images, frame_ids=None, pool=None):
+    frame_ids = frame_ids or [None] * len(images)
+    images = list(pool.map(resize_board, images)) if pool is not None else [resize_board(image) for image in images]
+
+    with metrics.span("piece_inference_batch"):
+        responses = model.infer_batch(images)
+
+    return [postprocess_response(response, frame_id) for response, frame_id in zip(responses, frame_ids)], images
+
+# Function to classify the square tiles of a warped board (only `cells` when given)
+def classify_tiles(classifier, image, cells=None, frame_id=None):
+    image = resize_board(image)
+
+    with metrics.span("tile_inference", frame_id):
+        classes, confidence = classifier.classify(image, cells)
+    records = tile_predictions(classes, confidence, 680)
+    return records, image, records_to_detections(records)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chess piece detection on the extracted board")
+    parser.add_argument("--transport", choices=["shm", "png"], default="shm", help="How boards are received from Extraction.py")
+    parser.add_argument("--backend", choices=["roboflow", "onnx"], default=INFERENCE_BACKEND, help="Where the piece model runs")
+    parser.add_argument("--threads", type=int, default=ONNX_THREADS, help="ONNX Runtime intra-op threads (0 = all cores)")
+    parser.add_argument("--mode", choices=["board", "tiles"], default=DETECTION_MODE, help="Full-board detector or per-square tile classifier")
+    parser.add_argument("--tile-model", default=TILE_MODEL_PATH, help="ONNX tile classifier used by --mode tiles")
+    parser.add_argument("--tile-backend", choices=["opencv", "onnxruntime"], default="opencv")
+    parser.add_argument("--change-thresh", type=float, default=12.0, help="Per-square gray difference that triggers inference")
+    parser.add_argument("--always-infer", action="store_true", help="Run the detector on every frame")
+    add_visualizer_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+
+    # Annotated detections are shown by the display thread, never in this loop
+    visualizer = create_visualizer(args.headless, args.display_fps)
+
+    # Load the model
+    if args.mode == "tiles":
+        classifier = TileClassifier(args.tile_model, args.tile_backend)
+    else:
+        model = load_model(backend=args.backend, threads=args.threads)
+    frame_ring = None
+
+    # Only run the detector when the board changed since the last inferred frame
+    gate = None if args.always_infer else ChangeGate(args.change_thresh)
+
+    # Define a loop for continuous inference
+    while True:
+        try:
+            if args.transport == "shm":
+                if frame_ring is None:
+                    frame_ring = FrameRing.attach()
+                # Newest board copied out of the shared memory slot, Extraction.py may reuse the slot during inference
+                # Spans and published records use Extraction.py's frame id, so both processes can be joined
+                image, _, frame_id = frame_ring.read_latest(timeout=2.0)
+                if image is None:
+                    continue
+            else:
+                # Read the image
+                image = cv2.imread("../saved_files/board.png")
+                frame_id = None
+
+            changed = None
+            if gate is not None:
+                changed, signature = gate.changed_squares(image)
+                if changed.size == 0:
+                    if args.transport == "png":
+                        time.sleep(0.1)
+                    continue
+                print("Changed squares:", changed.tolist())
+
+            if args.mode == "tiles":
+                # Only the changed tiles are classified again
+                records, image, detections = classify_tiles(classifier, image, changed, frame_id)
             else:
-                prediction_dict = {
-                    "detection_id": prediction.detection_id,
-                    "class_name": prediction.class_name,
-                    "class_id": prediction.class_id,
-                    "bounding_box": {
-                        "x": prediction.x,
-                        "y": prediction.y,
-                        "width": prediction.width,
-                        "height": prediction.height
-                    },
-                    "confidence": prediction.confidence
-                }
-            # # Check if a similar prediction already exists within a threshold around x and y coordinates
-            # should_add_prediction = True
-            # for existing_prediction in existing_predictions:
-            #     if abs(existing_prediction["bounding_box"]["x"] - prediction.x) < 20 and \
-            #        abs(existing_prediction["bounding_box"]["y"] - prediction.y) < 20:
-            #         should_add_prediction = False
-            #         break
-            # if should_add_prediction:
-            
-            #     existing_predictions.append(prediction_dict)
-            predictions_data.append(prediction_dict)
-            object_count += 1
-
-        # Write the predictions data to a JSON file
-        with open("../saved_files/predictions.json", "w") as json_file:
-            json.dump(predictions_data, json_file, indent=4)
-
-        # Print the total number of objects detected
-        print("Total Objects Detected:", object_count)
-
-        # Display the annotated image
-        cv2.imshow("Annotated Image", annotated_image)
-        # Wait for 1 second (1000 milliseconds)
-        cv2.waitKey(2000)
-
-    except Exception as e:
-        print("Error:", e)
-        # print("Image not available. Retrying in a second...")
-        time.sleep(1)
-        continue
+                records, image, detections = detect_pieces(model, image, frame_id)
+
+            # Publish the records as a binary state file (atomically replaced) for Localization_and_FEN.py
+            with metrics.span("publish", frame_id):
+                write_detections(DETECTIONS_PATH, records, frame_id)
+
+            # The change only counts as handled once it was published, a failed write is inferred again
+            if gate is not None:
+                gate.commit(signature)
+
+            # Print the total number of objects detected
+            print("Total Objects Detected:", len(records))
+
+            # Hand the annotation to the display thread, the image is a private copy of the ring slot
+            if visualizer is not None:
+                visualizer.show("Annotated Image", lambda scene=image, detections=detections:
+                                sv.BoundingBoxAnnotator().annotate(scene=scene, detections=detections))
+
+        except Exception as e:
+            print("Error:", e)
+            # print("Image not available. Retrying in a second...")
+            time.sleep(1)
+            continue
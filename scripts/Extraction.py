@@ -3,23 +3,45 @@
 
     1] This script sets up an inference pipeline to detect corners of a chessboard in a live video stream from a webcam.
     2] It annotates the detected corners on the video frame and extracts the chessboard image.
-    3] The extracted Chessboard image is then saved for further processing.
+    3] The extracted Chessboard image is then handed to Detection.py through the shared memory frame ring
+       (or saved as board.png when started with --transport png).
+    4] Both backends (roboflow and onnx) run in the same capture loop, the corner model only runs while the cached
+       transform is missing or the corner patches drifted (HomographyCache.needs_corners).
 
 
 '''
 
-from inference import InferencePipeline
 from inference.core.interfaces.camera.entities import VideoFrame
 import cv2
 import supervision as sv
 import numpy as np
 import time
+import os
+import argparse
+from datetime import datetime
+
+from frame_ring import FrameRing, DEFAULT_SHAPE
+from inference_backends import load_backend
+from visualizer import create_visualizer, add_visualizer_arguments
+from instrumentation import metrics, add_metrics_arguments, configure_metrics
+
+CORNER_MODEL_ID = "chess-corner-detection/1"
+VIDEO_REFERENCE = "../media/document_6064252294466113797.mp4" # To Use Mobile camera stream as webcam - 1, For video use - "../media/document_6064252294466113797.mp4"
 
 # Create a simple box annotator to use in our custom sink
 annotator = sv.BoxAnnotator()
 
 # Track the time of the last frame processing
-last_frame_time = time.time()
+last_frame_time = time.monotonic()
+
+# Shared memory ring for the extracted boards, None means board.png is written instead
+frame_ring = None
+
+# Last good board transform, reused while the corners stay put
+homography_cache = None
+
+# Display thread for the annotated frames, None in --headless mode
+visualizer = None
 
 # Function to calculate the center point of a bounding box
 def calculate_center(box):
@@ -44,8 +66,8 @@ def order_points(pts):
     
     return rect
 
-# Function to extract chessboard image using TL, TR, BL, BR corners
-def extract_chessboard(image, corners):
+# Function to order the corner box centers and get the size of the extracted board
+def board_geometry(corners):
     # Calculate the center point of each corner
     center_tl = calculate_center(corners[0])
     center_tr = calculate_center(corners[1])
@@ -65,6 +87,17 @@ def extract_chessboard(image, corners):
     height = max(np.linalg.norm(ordered_corners[1] - ordered_corners[2]),
                  np.linalg.norm(ordered_corners[3] - ordered_corners[0]))
 
+    return ordered_corners, width, height
+
+# Function to extract chessboard image using TL, TR, BL, BR corners
+def extract_chessboard(image, corners, cache=None):
+    # With a homography cache the transform is only recomputed when the corners drift
+    if cache is not None:
+        cache.update(image, corners)
+        return cache.warp(image)
+
+    ordered_corners, width, height = board_geometry(corners)
+
     # Create a destination array to hold the transformed image
     dst_points = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
 
@@ -76,6 +109,105 @@ def extract_chessboard(image, corners):
 
     return warped_image
 
+# Function to warp a frame with precomputed remap tables (HomographyCache.maps)
+def remap(image, maps):
+    return cv2.remap(image, maps[0], maps[1], cv2.INTER_LINEAR)
+
+class HomographyCache(object):
+    # Keeps the last good board transform as precomputed cv2.remap tables.
+    # The camera and board are fixed, so the transform is only recomputed when the
+    # detected corners move more than `tolerance` px, and the corner model only has
+    # to run when the image around the cached corners changes (drift) or every
+    # `recheck_interval` frames as a safety net.
+
+    def __init__(self, tolerance=6.0, recheck_interval=300, patch_size=24, patch_thresh=18.0):
+        self.tolerance = tolerance
+        self.recheck_interval = recheck_interval
+        self.patch_size = patch_size
+        self.patch_thresh = patch_thresh
+
+        self.corners = None
+        self.size = None
+        self.matrix = None
+        self.maps = None
+        self.patches = None
+        self.frames_since_check = 0
+
+    def valid(self):
+        return self.maps is not None
+
+    def _corner_patches(self, image):
+        # Small grayscale patches around the cached corners, used as a cheap drift signature
+        half = self.patch_size // 2
+        patches = []
+        for x, y in self.corners.astype(np.int32):
+            x0 = min(max(x - half, 0), image.shape[1] - self.patch_size)
+            y0 = min(max(y - half, 0), image.shape[0] - self.patch_size)
+            patch = image[y0:y0 + self.patch_size, x0:x0 + self.patch_size]
+            # Convert only the patch, not the whole frame
+            patches.append(cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY) if patch.ndim == 3 else patch)
+        return np.stack(patches).astype(np.int16)
+
+    def needs_corners(self, image):
+        # True when the corner model should run on this frame
+        if not self.valid() or self.frames_since_check >= self.recheck_interval:
+            return True
+        drift = np.abs(self._corner_patches(image) - self.patches).mean()
+        return drift > self.patch_thresh
+
+    def update(self, image, corners):
+        # Feed fresh corner detections, returns True when the transform was recomputed
+        self.frames_since_check = 0
+        if len(corners) != 4:
+            return False
+
+        ordered_corners, width, height = board_geometry(corners)
+        if self.valid() and np.abs(ordered_corners - self.corners).max() <= self.tolerance:
+            # Corners confirmed, the patches still follow lighting changes and sub-tolerance shifts,
+            # otherwise needs_corners() would keep asking for the corner model on every frame
+            self.patches = self._corner_patches(image)
+            return False
+
+        size = (int(width), int(height))
+        dst_points = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+        self.matrix = cv2.getPerspectiveTransform(ordered_corners, dst_points)
+        self.corners = ordered_corners
+        self.size = size
+
+        # Remap tables equivalent to cv2.warpPerspective: source position of every output pixel
+        u, v = np.meshgrid(np.arange(size[0], dtype=np.float32), np.arange(size[1], dtype=np.float32))
+        inverse = np.linalg.inv(self.matrix)
+        w = inverse[2, 0] * u + inverse[2, 1] * v + inverse[2, 2]
+        map_x = ((inverse[0, 0] * u + inverse[0, 1] * v + inverse[0, 2]) / w).astype(np.float32)
+        map_y = ((inverse[1, 0] * u + inverse[1, 1] * v + inverse[1, 2]) / w).astype(np.float32)
+        self.maps = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+        self.patches = self._corner_patches(image)
+        return True
+
+    def take_maps(self):
+        # Remap tables for one frame, counted like warp(). update() replaces the tuple as a whole, so a frame
+        # warped elsewhere with this snapshot (pipeline.py pool) never mixes the tables of two transforms
+        self.frames_since_check += 1
+        return self.maps
+
+    def warp(self, image):
+        return remap(image, self.take_maps())
+
+# Function to get the xyxy boxes of the corner detections of a single frame
+def detect_corners(model, image, frame_id=None):
+    with metrics.span("corner_inference", frame_id):
+        results = model.infer(image)[0]
+    boxes = [[p.x - p.width / 2, p.y - p.height / 2, p.x + p.width / 2, p.y + p.height / 2] for p in results.predictions]
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+# Function to get the xyxy corner boxes of several frames (one per board) in one batched call
+def detect_corners_batch(model, images):
+    with metrics.span("corner_inference_batch"):
+        responses = model.infer_batch(images)
+    return [np.array([[p.x - p.width / 2, p.y - p.height / 2, p.x + p.width / 2, p.y + p.height / 2]
+                      for p in response.predictions], dtype=np.float32).reshape(-1, 4) for response in responses]
+
 def my_custom_sink(predictions: dict, video_frame: VideoFrame):
     global last_frame_time
     
@@ -85,31 +217,86 @@ def my_custom_sink(predictions: dict, video_frame: VideoFrame):
     detections = sv.Detections.from_inference(predictions)
     print("Coordinates: ", detections.xyxy)
     
-    # Calculate time taken for processing the last frame
-    current_time = time.time()
-    processing_time = current_time - last_frame_time
+    # Time between two frames reaching the sink (corner inference included)
+    current_time = time.monotonic()
+    metrics.record("frame_interval", (current_time - last_frame_time) * 1000, video_frame.frame_id)
     last_frame_time = current_time
        
-    # Annotate the frame using Supervision annotator, the video_frame, the predictions, and the labels
-    annotated_image = annotator.annotate(
-        scene=video_frame.image.copy(), detections=detections, labels=labels
-    )
-    # Display the annotated image
-    cv2.imshow("Predictions", annotated_image)
-    cv2.waitKey(10)
+    # Annotate and display the frame in the display thread, only for the frames that are actually shown
+    if visualizer is not None:
+        visualizer.show("Predictions", lambda: annotator.annotate(
+            scene=video_frame.image.copy(), detections=detections, labels=labels))
     
-    if "predictions" in predictions and len(predictions["predictions"]) == 4:
-        # Extract chessboard image using TL, TR, BL, BR corners
-        chessboard_image = extract_chessboard(video_frame.image, detections.xyxy)
-        cv2.imwrite("../saved_files/board.png", chessboard_image)
+    with metrics.span("warp", video_frame.frame_id):
+        if "predictions" in predictions and len(predictions["predictions"]) == 4:
+            # Extract chessboard image using TL, TR, BL, BR corners
+            chessboard_image = extract_chessboard(video_frame.image, detections.xyxy, homography_cache)
+        elif homography_cache.valid():
+            # Corners partly hidden (e.g. by a hand), keep warping with the last good transform
+            chessboard_image = homography_cache.warp(video_frame.image)
+        else:
+            chessboard_image = None
+
+    if chessboard_image is not None:
+        hand_off(chessboard_image, video_frame.frame_id)
+
+# Function to pass a warped board on to Detection.py (shared memory ring or board.png)
+def hand_off(chessboard_image, frame_id):
+    if frame_ring is not None:
+        # Ring slots have a fixed shape, resize to the detector input size here
+        with metrics.span("handoff", frame_id):
+            frame_ring.write(cv2.resize(chessboard_image, DEFAULT_SHAPE[1::-1]), frame_id)
+    else:
+        with metrics.span("handoff", frame_id):
+            cv2.imwrite("../saved_files/board.png", chessboard_image)
         # Add a delay after saving the image (for example, 1 second)
         time.sleep(0.01) 
 
-pipeline = InferencePipeline.init(
-    model_id="chess-corner-detection/1",
-    video_reference="../media/document_6064252294466113797.mp4", # To Use Mobile camera stream as webcam - 1, For video use - "../media/document_6064252294466113797.mp4"
-    on_prediction=my_custom_sink,
-)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chessboard corner detection and extraction")
+    parser.add_argument("--transport", choices=["shm", "png"], default="shm", help="How boards are handed to Detection.py")
+    parser.add_argument("--backend", choices=["roboflow", "onnx"], default=os.environ.get("CHESS_INFERENCE_BACKEND", "roboflow"), help="Where the corner model runs")
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op threads (0 = all cores)")
+    add_visualizer_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+
+    visualizer = create_visualizer(args.headless, args.display_fps)
+
+    if args.transport == "shm":
+        frame_ring = FrameRing.create()
+    homography_cache = HomographyCache()
+
+    # Roboflow (ROBOFLOW_API_KEY) or the exported model offline, both answer model.infer(image)[0]
+    if args.backend == "onnx":
+        model = load_backend(CORNER_MODEL_ID, "onnx", intra_threads=args.threads)
+    else:
+        model = load_backend(CORNER_MODEL_ID, "roboflow")
 
-pipeline.start()
-pipeline.join()
+    cap = cv2.VideoCapture(VIDEO_REFERENCE)
+    frame_id = 0
+    try:
+        while True:
+            with metrics.span("capture", frame_id + 1):
+                ok, image = cap.read()
+            if not ok:
+                break
+            frame_id += 1
+            # Corner model only while the cached transform is missing or drifted
+            if not homography_cache.needs_corners(image):
+                with metrics.span("warp", frame_id):
+                    chessboard_image = homography_cache.warp(image)
+                hand_off(chessboard_image, frame_id)
+                continue
+            with metrics.span("corner_inference", frame_id):
+                results = model.infer(image)[0]
+            my_custom_sink(results.dict(by_alias=True, exclude_none=True),
+                           VideoFrame(image=image, frame_id=frame_id, frame_timestamp=datetime.now()))
+    finally:
+        cap.release()
+        if frame_ring is not None:
+            print("Frame ring:", frame_ring.stats())
+            frame_ring.close()
+        print(metrics.report())
+        metrics.close()
@@ -1,124 +1,127 @@
 ''' 
 Code Description:
 
-1] This script continuously processes predictions from the updated JSON file and updates a virtual chessboard with detected pieces.
-2] It uses the predictions to update the FEN representation of the board, generates SVG and PNG images of the updated board, and displays the PNG image.
+1] This script continuously processes the predictions published by Detection.py and updates a virtual chessboard with detected pieces.
+2] It uses the predictions to update the FEN representation of the board, the updated board is rendered and displayed by the display thread (visualizer.py, off with --headless).
+   The board state is voted over the last frames (fen_stabilizer.py), so the FEN only changes when a square really changed.
 3] The script runs in a while loop until interrupted by the user (Ctrl+C).
-4] It reads the updated predictions.json file in each iteration to ensure continuous processing.
+4] Predictions are read from the binary state file ../saved_files/predictions.bin (state_format.py), it is only
+   mapped again after Detection.py replaced it. Every new position is written to ../saved_files/board.bin
+   (occupancy, FEN) for engine_service.py and appended to the game log ../saved_files/game_log.bin.
+   Detection.py only replaces the file when the board changed, so on every --poll tick without a new file the last
+   detections are voted again until the stabilizer settles on them (one file is one vote otherwise).
 
 '''
 
 import chess
-import chess.svg
-import wand.image
-import json
-import cv2
 import numpy as np
-import os
 import time
+import argparse
+
+from square_mapping import SquareMapper, predictions_to_arrays
+from fen_stabilizer import FenStabilizer
+from game_tracker import GameTracker, board_occupancy
+from visualizer import create_visualizer, add_visualizer_arguments
+from board_renderer import BoardRenderer
+from state_format import StateReader, GameLog, write_board, KIND_DETECTIONS, DETECTIONS_PATH, BOARD_PATH, GAME_LOG_PATH
+
+# Function to assign all predictions of a frame to squares, returns (squares, pieces, confidence)
+def assign_predictions(mapper, predictions):
+    # Assign all predictions to their nearest square within +- 35 px in one step,
+    # the most confident prediction wins when two claim the same square
+    xy, pieces, confidence = predictions_to_arrays(predictions)
+    squares = mapper.assign(xy, confidence)
+    return squares, pieces, confidence
+
+# Function to vote one frame into the stabilizer, returns True when the stabilized board changed.
+# New detections are voted once, a frame skipped by the change gate (predictions None) votes the last detections again
+def vote(stabilizer, mapper, predictions):
+    if predictions is None:
+        return stabilizer.revote()
+    return stabilizer.update(*assign_predictions(mapper, predictions))
 
-# Function to convert file to 0-indexed integer
-def file_to_index(file):
-    return ord(file) - ord('a')
+# Define file paths
+chessboard_centers_path = '../saved_files/chessboard_centers.json'
+predictions_path = DETECTIONS_PATH
 
-# Function to convert rank to 0-indexed integer
-def rank_to_index(rank):
-    return int(rank) - 1
+# Threshold for prediction of piece (in pixels)
+thresh = 35 # Adjusted threshold
 
-# Function to load JSON data from file
-def load_json_data(file_path):
-    with open(file_path) as json_file:
-        return json.load(json_file)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Board localization and FEN generation")
+    parser.add_argument("--start-fen", default=chess.STARTING_FEN, help="Position the game starts from")
+    parser.add_argument("--free", action="store_true", help="Do not track a game, write the observed placement only")
+    parser.add_argument("--poll", type=float, default=0.05, help="Seconds between checks for new predictions")
+    add_visualizer_arguments(parser)
+    args = parser.parse_args()
 
-def save_string_to_file(filename, string_to_save):
-    with open(filename, 'w') as file:
-        file.write(string_to_save)
+    visualizer = create_visualizer(args.headless, args.display_fps)
+    # Sprite based 2D board, only the changed squares are redrawn (used by the display thread only)
+    renderer = None if visualizer is None else BoardRenderer(400)
 
-# Define file paths
-chessboard_centers_path = '../saved_files/chessboard_centers.json'
-predictions_path = '../saved_files/predictions.json'
+    # The real game (move history, castling and en passant rights), moves are inferred from legal moves only
+    tracker = None if args.free else GameTracker(args.start_fen)
 
-# Mapping classes to piece name
-class_mapping = {
-    "1": "b", "2": "k", "3": "n", "4": "p", "5": "q", "6": "r",
-    "7": "B", "8": "K", "9": "N", "10": "P", "11": "Q", "12": "R"
-}
+    # Chessboard centers are fixed for the warped board, load them only once
+    mapper = None
 
-# Threshold for prediction of piece (in pixels)
-thresh = 35 # Adjusted threshold
-while True:
-    try:
-    # Continuous processing until interrupted
-    
-        # Load JSON data from files
-        board_centers = load_json_data(chessboard_centers_path)
-        predictions = load_json_data(predictions_path)
-
-        # Create an empty chess board
-        board = chess.Board(fen="8/8/8/8/8/8/8/8 w - - 0 1")
-
-        # Iterate through the predictions and update the board
-        for prediction in predictions:
-            pred_x = prediction["bounding_box"]["x"]
-            pred_y = prediction["bounding_box"]["y"]
-            closest_square = None
-            in_box = False
-
-            # Iterate over all Chessboard center coordinates to find the perfect match for the selected prediction
-            for square, coord in board_centers.items():
-                square_x, square_y = coord
-                # If predicted coordinate falls in a box within +- 35 px of Chessboard center we got the match
-                if(abs(square_x - pred_x) <= thresh and abs(square_y - pred_y) <=thresh):
-                    in_box = True
-                    closest_square = square
-                    break
-
-            # Ensure a closest square is found
-            if closest_square and in_box :  # Added condition for threshold
-                file_index = file_to_index(closest_square[0])  # Convert file to 0-indexed integer
-                rank = rank_to_index(closest_square[1])  # Convert rank to 0-indexed integer
-                piece_name = class_mapping[prediction["class_name"]]
-                board.set_piece_at(chess.square(file_index, rank), chess.Piece.from_symbol(piece_name))
-
-        # Save FEN string to a file for later usage
-        fen_string = board.fen()
-        filename = "../saved_files/fen.txt"
-        save_string_to_file(filename, fen_string)
-
-        # Print the FEN string
-        print("FEN:", fen_string)
-
-        # Generate SVG representation of the board
-        board_svg = chess.svg.board(board=board, size=400, coordinates=False)
-
-        # Save the SVG to a temporary file
-        with open("../saved_files/chessboard.svg", "w") as svg_file:
-            svg_file.write(board_svg)
-
-        # Convert SVG to PNG using wand
-        with wand.image.Image() as image:
-            image.read(blob=board_svg.encode('utf-8'), format="svg")
-            png_image = image.make_blob("png32")
-
-        # Save the PNG image
-        with open("../saved_files/chessboard.png", "wb") as out:
-            out.write(png_image)
-
-        print("Chessboard images saved as chessboard.svg and chessboard.png")
-
-        # Load the saved image and display
-        img = cv2.imread("../saved_files/chessboard.png")
-        cv2.imshow('Board', img)
-        cv2.waitKey(1000)  # Display for 1 second
-        # cv2.destroyAllWindows()
-        
-        # Remove temporary files
-        os.remove("../saved_files/chessboard.svg")
-        os.remove("../saved_files/chessboard.png")
+    # Per-square voting over the last frames, a new FEN is only written when a square really changed
+    stabilizer = FenStabilizer()
 
-    except Exception as e:
-        ("Error:", e)
-        # print("Image not available. Retrying in a second...")
+    # Predictions are only read again after Detection.py replaced the file, every new position is logged
+    reader = StateReader(predictions_path, KIND_DETECTIONS)
+    game_log = GameLog(GAME_LOG_PATH)
+    frame_id = None
 
-        time.sleep(1)
-        continue
+    while True:
+        try:
+        # Continuous processing until interrupted
+        
+            # Load the square centers once and the predictions whenever they were replaced
+            if mapper is None:
+                mapper = SquareMapper.from_file(chessboard_centers_path, thresh)
+            state = reader.poll()
+            if state is None:
+                # No new file: the last detections still hold, vote them again until the board settles
+                if not vote(stabilizer, mapper, None):
+                    time.sleep(args.poll)
+                    continue
+            else:
+                # Copy the records out of the map and drop it, a map kept open across idle ticks makes
+                # Detection.py's os.replace fail on Windows
+                header, records = state
+                frame_id = int(header["frame_id"])
+                predictions = np.array(records)
+                del state, header, records
+                if not vote(stabilizer, mapper, predictions):
+                    continue
+            if tracker is None:
+                board = stabilizer.board()
+            else:
+                move = tracker.observe(stabilizer.state, stabilizer.square_confidence())
+                if move is None:
+                    if not tracker.matches(stabilizer.state):
+                        print("Observed board does not match a legal move yet")
+                    continue
+                print("Move:", move.uci())
+                board = tracker.board
+
+            # Save the position for later usage, atomically replaced and appended to the game log
+            fen_string = board.fen()
+            occupancy = board_occupancy(board)
+            write_board(BOARD_PATH, occupancy, fen_string, frame_id)
+            game_log.append(occupancy, fen_string, frame_id)
+
+            # Print the FEN string
+            print("FEN:", fen_string)
+
+            # The board is rendered and shown by the display thread, this loop never waits for a window
+            if visualizer is not None:
+                visualizer.show('Board', lambda board=board.copy(): renderer.render(board))
+
+        except Exception as e:
+            ("Error:", e)
+            # print("Image not available. Retrying in a second...")
+
+            time.sleep(1)
+            continue
@@ -0,0 +1,141 @@
+'''
+Code Description:
+
+1] This module collects inference requests from several producers (board sessions, tile classifiers) and runs them
+   as one batched forward pass: a batch is closed when max_batch items are waiting or max_delay_ms passed since the
+   first request of the batch, whichever comes first.
+2] Every request gets a concurrent.futures.Future, the batch results are scattered back to the futures in order
+   (an exception of the batch is set on all of its futures).
+3] BatchScheduler.for_model(model) wraps a backend with infer_batch() and behaves like a model itself
+   (infer(image) -> [response]), so detect_pieces / detect_corners use it unchanged.
+4] BatchScheduler.for_tiles(classifier) batches tile arrays of different boards into one TileClassifier.infer call,
+   counting tiles (not requests) against max_batch (DEFAULT_TILE_BATCH, four full boards), every board classifies
+   through TileView(scheduler.call). multi_board.py --mode tiles --scheduler uses it.
+5] A batch function that returns fewer results than items fails the requests left without a result.
+
+'''
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from instrumentation import metrics
+
+DEFAULT_MAX_BATCH = 8
+DEFAULT_MAX_DELAY_MS = 5.0
+# Tiles are counted one by one, one board alone can send all 64
+DEFAULT_TILE_BATCH = 256
+
+
+class BatchScheduler(object):
+
+    def __init__(self, run_batch, max_batch=DEFAULT_MAX_BATCH, max_delay_ms=DEFAULT_MAX_DELAY_MS, size=None,
+                 name="batch"):
+        # run_batch(list of items) -> list of results in the same order, size(item) -> batch slots used (default 1)
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self.size = size or (lambda item: 1)
+        self.name = name
+
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=name + "-scheduler", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def for_model(cls, model, **kwargs):
+        return cls(model.infer_batch, **kwargs)
+
+    @classmethod
+    def for_tiles(cls, classifier, **kwargs):
+        # Items are (N, tile, tile, 3) arrays, results are the matching (N, 13) probability arrays
+        kwargs.setdefault("max_batch", DEFAULT_TILE_BATCH)
+
+        def run_batch(tile_arrays):
+            probabilities = classifier.infer(np.concatenate(tile_arrays))
+            return np.split(probabilities, np.cumsum([len(tiles) for tiles in tile_arrays])[:-1])
+        return cls(run_batch, size=len, **kwargs)
+
+    def submit(self, item):
+        future = Future()
+        self.requests.put((item, future, time.monotonic()))
+        return future
+
+    # Model interface, so a scheduler can replace the model it wraps
+
+    def infer(self, image):
+        return [self.submit(image).result()]
+
+    def infer_batch(self, images):
+        futures = [self.submit(image) for image in images]
+        return [future.result() for future in futures]
+
+    def call(self, item):
+        # Blocking submit for plain functions like TileClassifier.infer (for_tiles)
+        return self.submit(item).result()
+
+    def next_batch(self):
+        # Block for the first request, then collect until the batch is full or its deadline passed
+        try:
+            first = self.requests.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        used = self.size(first[0])
+        deadline = first[2] + self.max_delay
+        while used < self.max_batch:
+            # Requests already waiting always join, the deadline only limits how long to wait for more
+            remaining = deadline - time.monotonic()
+            try:
+                request = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            used += self.size(request[0])
+        return batch
+
+    def run(self):
+        while not self.stop_event.is_set():
+            batch = self.next_batch()
+            if not batch:
+                continue
+            started = time.monotonic()
+            for _, _, submitted in batch:
+                metrics.record(self.name + "_queue_wait", (started - submitted) * 1000)
+
+            try:
+                with metrics.span(self.name + "_batch_inference"):
+                    results = self.run_batch([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            results = list(results)
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+            for _, future, _ in batch[len(results):]:
+                future.set_exception(RuntimeError("%s batch returned %i results for %i requests" % (
+                    self.name, len(results), len(batch))))
+
+    def mean_batch(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join(timeout=1.0)
+        # Requests that were never run
+        while True:
+            try:
+                _, future, _ = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
@@ -0,0 +1,268 @@
+'''
+Code Description:
+
+1] This script replays recorded stills and videos through corner extraction, piece detection and localization
+   without a camera, and reports frames per second, per-stage latency (p50 / p95 / p99 from instrumentation.py)
+   and FEN accuracy against ground-truth annotations.
+2] The models are pluggable: --backend roboflow / onnx run the real models, --backend stub answers without any model
+   (board corners at the image corners, pieces generated from the ground truth) with an optional simulated latency,
+   so the code around the models can be measured on any machine.
+3] Results are saved as JSON (commit, settings, fps, stage summary, accuracy per source) and --compare prints the
+   difference to an earlier run, so regressions are caught before they reach the cell.
+
+Ground truth file (--truth), placements are compared (the first FEN field), videos are annotated from a frame index on:
+   {"Chess9.jpg": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR",
+    "game.mp4": {"0": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR", "240": "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR"}}
+
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import time
+
+import chess
+import cv2
+import numpy as np
+
+from Extraction import detect_corners, HomographyCache, CORNER_MODEL_ID
+from Detection import detect_pieces, load_model, PIECE_MODEL_ID, ONNX_THREADS
+from Localization_and_FEN import assign_predictions, chessboard_centers_path, thresh
+from square_mapping import SquareMapper, grid_centers, board_array
+from fen_stabilizer import FenStabilizer, board_from_occupancy
+from game_tracker import board_occupancy
+from inference_backends import load_backend, Prediction
+from postprocess import Y_OFFSET
+from instrumentation import metrics
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
+BOARD_SIZE = 680
+
+
+def list_sources(paths):
+    # Files given directly or found in the given directories, sorted for reproducible runs
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources += [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        else:
+            sources.append(path)
+    return [s for s in sources if s.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS)]
+
+
+def read_frames(path, repeat=1, stride=1, max_frames=None):
+    # (frame index, image) of a still (repeated) or a video
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        image = cv2.imread(path)
+        if image is None:
+            return
+        for i in range(repeat):
+            yield 0, image
+        return
+
+    cap = cv2.VideoCapture(path)
+    index, count = 0, 0
+    try:
+        while max_frames is None or count < max_frames:
+            ok, image = cap.read()
+            if not ok:
+                break
+            if index % stride == 0:
+                count += 1
+                yield index, image
+            index += 1
+    finally:
+        cap.release()
+
+
+def truth_at(annotation, frame_index):
+    # Ground truth placement of a frame, None when the source is not annotated
+    if annotation is None or isinstance(annotation, str):
+        return annotation
+    known = [int(i) for i in annotation if int(i) <= frame_index]
+    return annotation[str(max(known))] if known else None
+
+
+def stub_corners(image):
+    # Corner boxes 5 % inside the image corners
+    height, width = image.shape[:2]
+    box = 0.05 * min(width, height)
+    return [Prediction(x, y, box, box, 0.99, "corner", 0)
+            for x, y in ((box, box), (width - box, box), (width - box, height - box), (box, height - box))]
+
+
+class StubPieces(object):
+    # Piece predictions on the square centers of the current ground truth placement
+
+    def __init__(self, centers):
+        self.centers = centers
+        self.placement = None
+
+    def __call__(self, image):
+        if self.placement is None:
+            return []
+        occupancy = board_occupancy(chess.BaseBoard(self.placement))
+        predictions = []
+        for square in np.flatnonzero(occupancy):
+            x, y = self.centers[square]
+            piece = int(occupancy[square])
+            # Detector boxes sit above the square center, postprocess adds the class offset back
+            predictions.append(Prediction(float(x), float(y - Y_OFFSET[piece]), 60.0, 80.0, 0.95, str(piece), piece))
+        return predictions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Replay(object):
+
+    def __init__(self, corner_model, piece_model, mapper, warped=False, stub_pieces=None):
+        self.corner_model = corner_model
+        self.piece_model = piece_model
+        self.mapper = mapper
+        self.warped = warped            # inputs are already warped boards, skip the corner stage
+        self.stub_pieces = stub_pieces
+        self.frame_id = 0
+
+    def run_source(self, path, annotation, video, **read_args):
+        homography = HomographyCache()
+        stabilizer = FenStabilizer() if video else None
+        frames, correct, squares_correct, annotated = 0, 0, 0, 0
+
+        for index, image in read_frames(path, **read_args):
+            self.frame_id += 1
+            truth = truth_at(annotation, index)
+            if self.stub_pieces is not None:
+                self.stub_pieces.placement = truth
+
+            placement = self.process(image, homography, stabilizer)
+            frames += 1
+            if truth is not None:
+                annotated += 1
+                correct += placement == truth
+                expected = board_occupancy(chess.BaseBoard(truth))
+                observed = board_occupancy(chess.BaseBoard(placement)) if placement else np.zeros(64, np.int8)
+                squares_correct += int((expected == observed).sum())
+
+        return {"source": os.path.basename(path), "frames": frames, "annotated": annotated,
+                "fen_accuracy": correct / annotated if annotated else None,
+                "square_accuracy": squares_correct / (64.0 * annotated) if annotated else None}
+
+    def process(self, image, homography, stabilizer):
+        # One frame through the whole chain, returns the board placement (None when no board was found)
+        frame_id = self.frame_id
+        if self.warped:
+            board_image = image
+        else:
+            if homography.needs_corners(image):
+                homography.update(image, detect_corners(self.corner_model, image, frame_id))
+            if not homography.valid():
+                return None
+            with metrics.span("warp", frame_id):
+                board_image = homography.warp(image)
+
+        records, _, _ = detect_pieces(self.piece_model, board_image, frame_id)
+
+        with metrics.span("localization", frame_id):
+            squares, pieces, confidence = assign_predictions(self.mapper, records)
+            if stabilizer is None:
+                occupancy = board_array(squares, pieces)
+            else:
+                stabilizer.update(squares, pieces, confidence)
+                occupancy = stabilizer.state
+            return board_from_occupancy(occupancy).board_fen()
+
+
+def compare(result, previous):
+    # Print fps and p95 changes against an earlier result file
+    print("\nCompared with %s (%s):" % (previous.get("commit"), previous.get("timestamp")))
+    print("  fps %.1f -> %.1f" % (previous["fps"], result["fps"]))
+    for stage, s in sorted(result["stages"].items()):
+        old = previous["stages"].get(stage)
+        if old:
+            change = (s["p95"] - old["p95"]) / old["p95"] * 100 if old["p95"] else 0.0
+            print("  %-20s p95 %8.2f -> %8.2f ms (%+.0f %%)" % (stage, old["p95"], s["p95"], change))
+    for key in ("fen_accuracy", "square_accuracy"):
+        if previous.get(key) is not None and result.get(key) is not None:
+            print("  %s %.3f -> %.3f" % (key, previous[key], result[key]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline replay benchmark: throughput, stage latency and FEN accuracy")
+    parser.add_argument("inputs", nargs="*", default=["../media"], help="Images, videos or directories")
+    parser.add_argument("--truth", default=None, help="Ground truth JSON (see the description above)")
+    parser.add_argument("--backend", choices=["roboflow", "onnx", "stub"], default="stub")
+    parser.add_argument("--threads", type=int, default=ONNX_THREADS)
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Simulated model time per stub call in ms")
+    parser.add_argument("--warped", action="store_true", help="Inputs are already warped boards")
+    parser.add_argument("--repeat", type=int, default=10, help="Times every still is replayed")
+    parser.add_argument("--stride", type=int, default=1, help="Use every n-th video frame")
+    parser.add_argument("--max-frames", type=int, default=None, help="Frames per video")
+    parser.add_argument("--out", default=None, help="Result JSON (default ../saved_files/benchmarks/<time>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier result JSON to compare with")
+    args = parser.parse_args()
+
+    truth = {}
+    if args.truth:
+        with open(args.truth) as json_file:
+            truth = json.load(json_file)
+
+    centers_available = os.path.exists(chessboard_centers_path)
+    mapper = SquareMapper.from_file(chessboard_centers_path, thresh) if centers_available \
+        else SquareMapper(grid_centers(BOARD_SIZE), thresh)
+
+    stub_pieces = None
+    if args.backend == "stub":
+        latency = args.stub_latency / 1000.0
+        stub_pieces = StubPieces(mapper.centers)
+        corner_model = load_backend(CORNER_MODEL_ID, "stub", predictions=stub_corners, latency=latency)
+        piece_model = load_backend(PIECE_MODEL_ID, "stub", predictions=stub_pieces, latency=latency)
+    else:
+        corner_model = load_model(CORNER_MODEL_ID, args.backend, args.threads)
+        piece_model = load_model(PIECE_MODEL_ID, args.backend, args.threads)
+
+    replay = Replay(corner_model, piece_model, mapper, args.warped, stub_pieces)
+    sources = []
+    start = time.monotonic()
+    for path in list_sources(args.inputs):
+        video = path.lower().endswith(VIDEO_EXTENSIONS)
+        result = replay.run_source(path, truth.get(os.path.basename(path)), video,
+                                   repeat=args.repeat, stride=args.stride, max_frames=args.max_frames)
+        print("%-30s %5i frames  fen accuracy %s" % (result["source"], result["frames"], result["fen_accuracy"]))
+        sources.append(result)
+    elapsed = time.monotonic() - start
+
+    frames = sum(s["frames"] for s in sources)
+    annotated = sum(s["annotated"] for s in sources)
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "backend": args.backend,
+        "stub_latency_ms": args.stub_latency if args.backend == "stub" else None,
+        "frames": frames,
+        "seconds": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+        "stages": metrics.summary(),
+        "fen_accuracy": sum(s["fen_accuracy"] * s["annotated"] for s in sources if s["annotated"]) / annotated if annotated else None,
+        "square_accuracy": sum(s["square_accuracy"] * s["annotated"] for s in sources if s["annotated"]) / annotated if annotated else None,
+        "sources": sources,
+    }
+
+    print("\n%i frames in %.2f s: %.1f fps, fen accuracy %s" % (frames, elapsed, result["fps"], result["fen_accuracy"]))
+    print(metrics.report())
+
+    out = args.out or os.path.join("../saved_files/benchmarks", time.strftime("bench_%Y%m%d_%H%M%S.json"))
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as json_file:
+        json.dump(result, json_file, indent=2)
+    print("Results saved to", out)
+
+    if args.compare:
+        with open(args.compare) as json_file:
+            compare(result, json.load(json_file))
@@ -0,0 +1,138 @@
+'''
+Code Description:
+
+1] This module draws the 2D board straight into a NumPy image, replacing chess.svg -> wand (ImageMagick) -> PNG -> imread.
+2] The 12 piece glyphs are rasterized once into a sprite atlas (chess.svg pieces through wand when it is installed,
+   simple drawn glyphs otherwise) and cached on disk, so ImageMagick is never used again after the first run.
+3] Every (piece, square color) combination is composited once into a ready tile, drawing a square is one array copy.
+4] BoardRenderer keeps its image between calls and only redraws the squares whose piece changed since the last frame.
+
+'''
+
+import os
+
+import chess
+import cv2
+import numpy as np
+
+from game_tracker import board_occupancy
+from square_mapping import PIECE_SYMBOLS
+
+# Same square colors as chess.svg (BGR)
+LIGHT_SQUARE = (158, 206, 255)
+DARK_SQUARE = (71, 139, 209)
+
+ATLAS_PATH = "../saved_files/piece_atlas_%i.npy"
+
+
+def rasterize_piece(symbol, square):
+    # chess.svg glyph of one piece as a BGRA sprite, needs wand (only used while building the atlas)
+    import wand.image
+    import wand.color
+    import chess.svg
+
+    piece_svg = chess.svg.piece(chess.Piece.from_symbol(symbol), size=square)
+    with wand.image.Image(background=wand.color.Color("transparent")) as image:
+        image.read(blob=piece_svg.encode("utf-8"), format="svg")
+        image.resize(square, square)
+        png = image.make_blob("png32")
+    return cv2.imdecode(np.frombuffer(png, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+def draw_piece(symbol, square):
+    # Fallback glyph without ImageMagick: disc in the piece color with its letter
+    sprite = np.zeros((square, square, 4), dtype=np.uint8)
+    white = symbol.isupper()
+    fill = (245, 245, 245, 255) if white else (40, 40, 40, 255)
+    ink = (40, 40, 40, 255) if white else (245, 245, 245, 255)
+    center, radius = (square // 2, square // 2), int(square * 0.4)
+    cv2.circle(sprite, center, radius, fill, -1, cv2.LINE_AA)
+    cv2.circle(sprite, center, radius, (0, 0, 0, 255), max(1, square // 25), cv2.LINE_AA)
+
+    letter = symbol.upper()
+    scale = square / 40.0
+    thickness = max(1, square // 20)
+    (width, height), _ = cv2.getTextSize(letter, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+    origin = ((square - width) // 2, (square + height) // 2)
+    cv2.putText(sprite, letter, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, ink, thickness, cv2.LINE_AA)
+    return sprite
+
+
+def build_atlas(square):
+    # (13, square, square, 4) BGRA sprites indexed by piece class (index 0 = empty)
+    try:
+        import wand.image  # noqa: F401
+        from wand.exceptions import WandException
+    except ImportError:
+        return fill_atlas(draw_piece, square)
+
+    try:
+        return fill_atlas(rasterize_piece, square)
+    except WandException as e:
+        # e.g. MissingDelegateError when ImageMagick was built without the SVG delegate
+        print("ImageMagick cannot rasterize the pieces (%s), using drawn pieces" % e)
+        return fill_atlas(draw_piece, square)
+
+
+def fill_atlas(make_sprite, square):
+    atlas = np.zeros((13, square, square, 4), dtype=np.uint8)
+    for piece_class in range(1, 13):
+        atlas[piece_class] = make_sprite(PIECE_SYMBOLS[piece_class], square)
+    return atlas
+
+
+def load_atlas(square, path=ATLAS_PATH):
+    # Sprite atlas from the disk cache, built (and cached) on the first use
+    path = path % square
+    if os.path.exists(path):
+        return np.load(path)
+    atlas = build_atlas(square)
+    try:
+        np.save(path, atlas)
+    except OSError:
+        pass
+    return atlas
+
+
+def compose_tiles(atlas):
+    # (13, 2, square, square, 3) tiles: every piece class on a light (0) and a dark (1) square
+    square = atlas.shape[1]
+    alpha = atlas[..., 3:].astype(np.float32) / 255.0
+    tiles = np.empty((13, 2, square, square, 3), dtype=np.uint8)
+    for color, background in enumerate((LIGHT_SQUARE, DARK_SQUARE)):
+        background = np.array(background, dtype=np.float32)
+        tiles[:, color] = (atlas[..., :3] * alpha + background * (1.0 - alpha)).astype(np.uint8)
+    return tiles
+
+
+class BoardRenderer(object):
+
+    def __init__(self, size=400, flipped=False, atlas_path=ATLAS_PATH):
+        self.square = size // 8
+        self.flipped = flipped
+        self.tiles = compose_tiles(load_atlas(self.square, atlas_path))
+        self.image = np.empty((self.square * 8, self.square * 8, 3), dtype=np.uint8)
+        # Piece class drawn on every square, -1 forces the first render to draw everything
+        self.drawn = np.full(64, -1, dtype=np.int8)
+
+        # Pixel origin and square color of every square in chess.SQUARES order
+        squares = np.arange(64)
+        files, ranks = squares % 8, squares // 8
+        if flipped:
+            files, ranks = 7 - files, 7 - ranks
+        self.rows = (7 - ranks) * self.square
+        self.cols = files * self.square
+        self.colors = ((squares % 8 + squares // 8) % 2 == 0).astype(np.int8)  # a1 is dark
+
+    def render(self, board):
+        # board: chess.Board or 64-entry occupancy array, returns the (reused) image
+        occupancy = board_occupancy(board) if isinstance(board, chess.BaseBoard) else np.asarray(board, dtype=np.int8)
+        s = self.square
+        for square in np.flatnonzero(occupancy != self.drawn):
+            row, col = self.rows[square], self.cols[square]
+            self.image[row:row + s, col:col + s] = self.tiles[occupancy[square], self.colors[square]]
+        self.drawn[:] = occupancy
+        return self.image
+
+    def reset(self):
+        self.drawn[:] = -1
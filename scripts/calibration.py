@@ -0,0 +1,166 @@
+'''
+Code Description:
+
+1] This module fits the mapping from board squares to robot coordinates from a few measured reference squares
+   (e.g. the four corner squares jogged with the teaching pendant) instead of a hand-entered table per square.
+2] Board grid coordinates (file, rank) are mapped to robot X/Y with a homography (4+ references, RANSAC rejects bad points)
+   or an affine fit (3 references), the grasp height Z is fitted as a plane so a tilted board is handled too.
+3] The fit is evaluated once into a dense lookup table: the 64 squares in chess.SQUARES order followed by the graveyard
+   slots beside the board, saved as a compact .npy file. SquareLUT gives O(1) square -> (x, y, z) lookups.
+4] check_table() fits a hand-entered per-file table like realworld_coordinates.json and reports inconsistent entries.
+
+Reference file format (robot frame, mm):  {"a1": [x, y, z], "h1": [x, y, z], "a8": [x, y, z], "h8": [x, y, z]}
+
+'''
+
+import argparse
+import json
+
+import cv2
+import numpy as np
+
+from square_mapping import SQUARE_NAMES, SQUARE_INDEX
+
+DEFAULT_LUT_PATH = "../saved_files/square_lut.npy"
+
+# Graveyard slots: two columns of 8 beside each long side of the board, in grid units (file, rank)
+GRAVEYARD_FILES = (-1.5, -2.5, 8.5, 9.5)
+
+
+def square_grid(name):
+    # "e4" -> (file, rank) grid coordinates, a1 = (0, 0)
+    index = SQUARE_INDEX[name]
+    return float(index % 8), float(index // 8)
+
+
+def graveyard_grid():
+    # (N, 2) grid coordinates of all graveyard slots
+    return np.array([(f, r) for f in GRAVEYARD_FILES for r in range(8)], dtype=np.float64)
+
+
+def board_grid():
+    # (64, 2) grid coordinates of the squares in chess.SQUARES order
+    return np.array([(i % 8, i // 8) for i in range(64)], dtype=np.float64)
+
+
+class BoardFit(object):
+    # Fitted map from grid coordinates to robot (x, y, z)
+
+    def __init__(self, xy_matrix, z_plane, inliers):
+        self.xy_matrix = xy_matrix  # 3x3 homography (affine fits have [0, 0, 1] as last row)
+        self.z_plane = z_plane      # z = a * file + b * rank + c
+        self.inliers = inliers      # boolean mask over the reference points
+
+    def apply(self, grid):
+        grid = np.asarray(grid, dtype=np.float64).reshape(-1, 2)
+        xy = cv2.perspectiveTransform(grid[None], self.xy_matrix)[0]
+        z = grid @ self.z_plane[:2] + self.z_plane[2]
+        return np.column_stack([xy, z])
+
+
+def fit(grid, xyz, ransac_thresh=5.0):
+    # Fit grid (N, 2) -> robot xyz (N, 3), N >= 3
+    grid = np.asarray(grid, dtype=np.float64)
+    xyz = np.asarray(xyz, dtype=np.float64)
+    if len(grid) < 3:
+        raise ValueError("At least 3 reference squares are needed")
+
+    if len(grid) >= 4:
+        method = cv2.RANSAC if len(grid) > 4 else 0
+        matrix, mask = cv2.findHomography(grid, xyz[:, :2], method, ransac_thresh)
+        inliers = mask.ravel().astype(bool) if mask is not None else np.ones(len(grid), dtype=bool)
+    else:
+        affine, _, _, _ = np.linalg.lstsq(np.column_stack([grid, np.ones(len(grid))]), xyz[:, :2], rcond=None)
+        matrix = np.vstack([affine.T, [0.0, 0.0, 1.0]])
+        inliers = np.ones(len(grid), dtype=bool)
+
+    design = np.column_stack([grid[inliers], np.ones(inliers.sum())])
+    z_plane, _, _, _ = np.linalg.lstsq(design, xyz[inliers, 2], rcond=None)
+    return BoardFit(matrix, z_plane, inliers)
+
+
+def fit_references(references):
+    # {"a1": [x, y, z], ...} -> BoardFit
+    names = list(references)
+    grid = np.array([square_grid(name) for name in names])
+    xyz = np.array([references[name] for name in names], dtype=np.float64)
+    return fit(grid, xyz)
+
+
+def build_lut(board_fit):
+    # (64 + graveyard, 3) float32 lookup table
+    return np.vstack([board_fit.apply(board_grid()), board_fit.apply(graveyard_grid())]).astype(np.float32)
+
+
+class SquareLUT(object):
+
+    def __init__(self, table):
+        self.table = np.asarray(table, dtype=np.float32)
+        self.graveyard_slots = len(self.table) - 64
+
+    @classmethod
+    def load(cls, path=DEFAULT_LUT_PATH):
+        return cls(np.load(path))
+
+    def save(self, path=DEFAULT_LUT_PATH):
+        np.save(path, self.table)
+
+    def pose(self, square):
+        # square index (chess.E4) or name ("e4") -> (x, y, z)
+        if isinstance(square, str):
+            square = SQUARE_INDEX[square]
+        return self.table[square]
+
+    def graveyard(self, slot):
+        return self.table[64 + slot]
+
+    def graveyard_poses(self):
+        return self.table[64:]
+
+
+def table_points(table):
+    # realworld_coordinates.json layout ({"a": [[x, y] x 8 ranks], ...}) -> grid (64, 2), points (64, 2)
+    grid, points = [], []
+    for file_name, coords in table.items():
+        for rank, coord in enumerate(coords):
+            grid.append((ord(file_name) - ord("a"), rank))
+            points.append(coord[:2])
+    return np.array(grid, dtype=np.float64), np.array(points, dtype=np.float64)
+
+
+def check_table(table, ransac_thresh=3.0):
+    # Fit a hand-entered table, returns (fitted (64, 2) points in chess.SQUARES order, list of (square, entered, fitted))
+    grid, points = table_points(table)
+    xyz = np.column_stack([points, np.zeros(len(points))])
+    board_fit = fit(grid, xyz, ransac_thresh)
+    fitted = board_fit.apply(grid)[:, :2]
+
+    outliers = []
+    for (f, r), entered, good, inlier in zip(grid, points, fitted, board_fit.inliers):
+        if not inlier:
+            outliers.append((SQUARE_NAMES[int(r) * 8 + int(f)], entered.tolist(), np.round(good, 1).tolist()))
+
+    centers = board_fit.apply(board_grid())[:, :2]
+    return centers, outliers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the square -> robot coordinate lookup table")
+    parser.add_argument("--references", help="JSON with measured robot xyz of a few squares")
+    parser.add_argument("--out", default=DEFAULT_LUT_PATH)
+    parser.add_argument("--check-table", help="Report inconsistent entries of a per-file table (realworld_coordinates.json)")
+    args = parser.parse_args()
+
+    if args.check_table:
+        with open(args.check_table) as json_file:
+            _, outliers = check_table(json.load(json_file))
+        for square, entered, fitted in outliers:
+            print("Inconsistent entry %s: %s, fit expects %s" % (square, entered, fitted))
+        print("%i inconsistent entries" % len(outliers))
+
+    if args.references:
+        with open(args.references) as json_file:
+            board_fit = fit_references(json.load(json_file))
+        lut = SquareLUT(build_lut(board_fit))
+        lut.save(args.out)
+        print("Saved %i squares + %i graveyard slots to %s" % (64, lut.graveyard_slots, args.out))
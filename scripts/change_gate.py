@@ -0,0 +1,60 @@
+'''
+Code Description:
+
+1] This module decides whether the piece detector has to run on a new warped board frame at all.
+2] The board is converted to gray and downsampled with cv2.INTER_AREA to a few pixels per square, the mean absolute
+   difference against the last inferred frame is then computed per square.
+3] Only when one or more squares changed beyond the threshold the detector runs, the changed squares are passed on
+   as grid cell indices (row * 8 + col in image coordinates, use SquareMapper.grid_table to get chess squares).
+4] Most of a game is spent waiting for the human, so most frames never reach model.infer.
+
+'''
+
+import cv2
+import numpy as np
+
+
+class ChangeGate(object):
+
+    def __init__(self, thresh=12.0, cell=8, refresh_interval=0):
+        self.thresh = thresh                    # mean abs gray difference per square to count as changed
+        self.cell = cell                        # downsampled pixels per square side
+        self.refresh_interval = refresh_interval  # force inference after this many skipped frames (0 = never)
+        self.reference = None
+        self.skipped = 0
+
+    def signature(self, image):
+        # Downsample first, the gray conversion then only touches a few thousand pixels
+        side = 8 * self.cell
+        small = cv2.resize(image, (side, side), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.int16)
+
+    def square_differences(self, signature):
+        # (64,) mean absolute difference of every square against the reference frame
+        diff = np.abs(signature - self.reference)
+        return diff.reshape(8, self.cell, 8, self.cell).mean(axis=(1, 3)).ravel()
+
+    def changed_squares(self, image):
+        # Grid cells that changed since the last inferred frame, all 64 when there is no reference yet.
+        # Returns (cells, signature), pass the signature to commit() once the detector has run.
+        signature = self.signature(image)
+        if self.reference is None:
+            return np.arange(64), signature
+
+        cells = np.flatnonzero(self.square_differences(signature) > self.thresh)
+        if cells.size == 0 and self.refresh_interval and self.skipped >= self.refresh_interval:
+            cells = np.arange(64)
+        if cells.size == 0:
+            self.skipped += 1
+        return cells, signature
+
+    def commit(self, signature):
+        # Make the frame that was just inferred the new reference
+        self.reference = signature
+        self.skipped = 0
+
+    def reset(self):
+        self.reference = None
+        self.skipped = 0
@@ -1,5 +1,6 @@
 import time
 from sockets_TFM import *
+from instrumentation import metrics
 
 class RCommands(object):
     #Commands to control de robotIP
@@ -138,12 +139,14 @@ def sendCommand(RT3_address, RT3_sock, command):
 
         msg = command.encode('utf-8')
 
-        #Send command to robot
+        #Send command to robot and time the round trip
+        start = time.monotonic_ns()
         DataTransmission(RT3_address,RT3_sock,msg)
 
         try:
-            RT3_sock.settimeout(300.0)
-            data, addr = RT3_sock.recvfrom(MAXBUFLEN)
+            #One request, one reply: the controller does not terminate it, it ends when the stream goes idle
+            data = GetReader(RT3_sock, idle_timeout=IDLE_TIMEOUT).read_message(timeout=300.0)
+            metrics.record("rt3_command", (time.monotonic_ns() - start) / 1e6, start_ns=start)
         except Exception as e:
             print("Exception %s occured during recieving data" %(e))
             RT3_sock.shutdown(socket.SHUT_RDWR)
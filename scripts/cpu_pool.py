@@ -0,0 +1,82 @@
+'''
+Code Description:
+
+1] This module spreads the OpenCV / NumPy work around the models (board warp, resize to 680 x 680, change detection)
+   over several cores instead of running it in the thread that also does the I/O. Detection post-processing works on
+   a few dozen boxes, is mostly Python under the GIL and gains nothing from threads, so it stays inline.
+2] CpuPool is a thread pool by default: cv2.remap / cv2.resize / cv2.warpPerspective and the NumPy array work release
+   the GIL, so threads scale without copying frames between processes. kind="process" uses worker processes
+   (functions and arguments must be picklable, frames are copied).
+3] OpenCV's own thread pool is set with cv2.setNumThreads(cv_threads): 1 thread per call is best when many frames
+   or boards run in parallel, otherwise every call would try to use all cores at once. In thread mode the setting
+   is process wide: it also applies to the OpenCV calls outside the pool (e.g. the cv2.dnn tile classifier), pass
+   a larger --cv-threads when those dominate. In process mode every worker sets it on start and the parent is
+   left alone.
+4] Back-pressure: at most max_pending calls are in flight, submit() blocks when the pool is saturated, so a fast
+   producer slows down (and the bounded pipeline queues drop stale frames) instead of piling up work.
+5] map() runs a function over items in parallel and yields the results in input order.
+
+'''
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import cv2
+
+
+def init_worker(cv_threads):
+    cv2.setNumThreads(cv_threads)
+
+
+class CpuPool(object):
+
+    def __init__(self, workers=None, kind="thread", cv_threads=1, max_pending=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.kind = kind
+        if kind == "thread":
+            init_worker(cv_threads)
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="cpu")
+        elif kind == "process":
+            self.executor = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(cv_threads,))
+        else:
+            raise ValueError("Unknown worker pool kind %s" % kind)
+        self.max_pending = max_pending or 2 * self.workers
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+
+    def submit(self, function, *args):
+        # Blocks while max_pending calls are in flight
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(function, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def map(self, function, *iterables):
+        # Parallel map with results in input order, never more than max_pending calls in flight
+        pending = deque()
+        for args in zip(*iterables):
+            if len(pending) >= self.max_pending:
+                yield pending.popleft().result()
+            pending.append(self.submit(function, *args))
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def add_pool_arguments(parser):
+    parser.add_argument("--cpu-workers", type=int, default=0, help="Worker pool for warp / resize / change detection (0 = off)")
+    parser.add_argument("--cv-threads", type=int, default=1, help="cv2.setNumThreads while the pool is on, process wide (also the unpooled OpenCV calls such as the tile classifier)")
+
+
+def create_pool(args):
+    # Thread pool, None when --cpu-workers is 0 (the callers then run everything inline)
+    if not args.cpu_workers:
+        return None
+    return CpuPool(args.cpu_workers, "thread", args.cv_threads)
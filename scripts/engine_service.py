@@ -0,0 +1,190 @@
+'''
+Code Description:
+
+1] This module keeps one long-lived UCI engine process (Stockfish by default) for the whole game,
+   so process spawn and engine warm-up are paid once instead of for every move.
+2] best_move(board) answers from an LRU cache of (position -> bestmove, score, depth) first. Positions are keyed by
+   their Zobrist hash, so repeated and transposed positions return instantly.
+3] After every answer the engine ponders: it analyses the position after the expected reply while the human thinks,
+   and the result lands in the cache, so a predicted reply costs no search time at all.
+4] The script polls ../saved_files/board.bin (written by Localization_and_FEN.py, see state_format.py) and prints
+   the engine move whenever it is the robot's turn. Use --engine standin to run without a compiled Stockfish.
+
+'''
+
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import chess
+import chess.engine
+import chess.polyglot
+
+from instrumentation import metrics
+from state_format import StateReader, KIND_BOARD, BOARD_PATH, fen as record_fen
+
+STOCKFISH_PATH = "stockfish/src/stockfish"
+STANDIN_ENGINE = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "standin_engine.py")]
+
+
+class EngineResult(object):
+    def __init__(self, move, score, depth, ponder=None):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.ponder = ponder
+
+
+class EngineService(object):
+
+    def __init__(self, command=STOCKFISH_PATH, limit=None, cache_size=4096, ponder=True, options=None):
+        self.engine = chess.engine.SimpleEngine.popen_uci(command)
+        if options:
+            self.engine.configure(options)
+
+        self.limit = limit or chess.engine.Limit(time=0.5)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.ponder = ponder
+
+        self.lock = threading.Lock()
+        self.pondering = None   # (key, analysis) of the running ponder search
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(board):
+        # Same position, side to move, castling and en passant rights -> same key (transpositions included)
+        return chess.polyglot.zobrist_hash(board)
+
+    def cached(self, board):
+        key = self.key(board)
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+        return result
+
+    def store(self, key, result):
+        with self.lock:
+            self.cache[key] = result
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def best_move(self, board):
+        # Best move for the side to move, from the cache, a finished ponder search or a fresh search
+        with metrics.span("engine"):
+            return self._best_move(board)
+
+    def _best_move(self, board):
+        key = self.key(board)
+        result = self.cached(board)
+        if result is None and self.pondering is not None and self.pondering[0] == key:
+            # The human played the expected reply, let the ponder search finish
+            self.finish_ponder()
+            result = self.cached(board)
+        else:
+            self.stop_ponder()
+
+        if result is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            play = self.engine.play(board, self.limit, info=chess.engine.INFO_SCORE | chess.engine.INFO_PV)
+            score = play.info.get("score")
+            result = EngineResult(play.move, score.relative if score else None, play.info.get("depth"), play.ponder)
+            self.store(key, result)
+
+        if self.ponder and result.move is not None and result.ponder is not None:
+            self.start_ponder(board, result.move, result.ponder)
+        return result
+
+    def start_ponder(self, board, move, reply):
+        # Analyse the position after our move and the expected reply while the human thinks
+        expected = board.copy(stack=False)
+        expected.push(move)
+        if not expected.is_legal(reply):
+            return
+        expected.push(reply)
+        key = self.key(expected)
+        if self.cached(expected) is not None:
+            return
+
+        analysis = self.engine.analysis(expected, self.limit)
+        self.pondering = (key, analysis)
+        threading.Thread(target=self._collect, args=(key, analysis), daemon=True).start()
+
+    def _collect(self, key, analysis):
+        # Store the ponder result once the search ends (limit reached or stopped)
+        analysis.wait()
+        info = analysis.info
+        pv = info.get("pv")
+        if pv and self.pondering is not None and self.pondering[0] == key:
+            score = info.get("score")
+            self.store(key, EngineResult(pv[0], score.relative if score else None, info.get("depth"),
+                                         pv[1] if len(pv) > 1 else None))
+
+    def finish_ponder(self):
+        key, analysis = self.pondering
+        analysis.wait()
+        # The collecting thread may still be storing the result
+        deadline = time.monotonic() + 0.5
+        while self.cached_key(key) is None and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.pondering = None
+
+    def cached_key(self, key):
+        with self.lock:
+            return self.cache.get(key)
+
+    def stop_ponder(self):
+        if self.pondering is not None:
+            _, analysis = self.pondering
+            self.pondering = None
+            analysis.stop()
+            analysis.wait()
+
+    def close(self):
+        self.stop_ponder()
+        self.engine.quit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Engine moves for the FENs written by Localization_and_FEN.py")
+    parser.add_argument("--engine", default=STOCKFISH_PATH, help="UCI engine executable, or 'standin'")
+    parser.add_argument("--board-file", default=BOARD_PATH, help="Binary board state written by Localization_and_FEN.py")
+    parser.add_argument("--robot-color", choices=["white", "black"], default="black")
+    parser.add_argument("--movetime", type=float, default=0.5, help="Search time per move in seconds")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    command = STANDIN_ENGINE if args.engine == "standin" else args.engine
+    options = None if args.engine == "standin" else {"Threads": args.threads}
+    service = EngineService(command, chess.engine.Limit(time=args.movetime), options=options)
+    robot_color = chess.WHITE if args.robot_color == "white" else chess.BLACK
+
+    last_fen = None
+    reader = StateReader(args.board_file, KIND_BOARD)
+    try:
+        while True:
+            state = reader.poll()
+            fen = record_fen(state[1][0]) if state is not None else None
+
+            if fen and fen != last_fen:
+                last_fen = fen
+                board = chess.Board(fen)
+                if board.turn == robot_color and not board.is_game_over():
+                    start = time.monotonic()
+                    result = service.best_move(board)
+                    print("Best move: %s score %s depth %s (%.0f ms, cache %i/%i)" % (
+                        result.move, result.score, result.depth, (time.monotonic() - start) * 1000,
+                        service.hits, service.hits + service.misses))
+            time.sleep(0.05)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
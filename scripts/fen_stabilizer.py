@@ -0,0 +1,102 @@
+'''
+Code Description:
+
+1] This module smooths the board state over several frames so that one missed or misclassified piece does not flip the FEN.
+2] A (64, 13) NumPy accumulator keeps per-square class scores (index 0 = empty, 1-12 = class_mapping), every frame the
+   scores decay exponentially and the detections of the frame are added with their confidence.
+3] A square only takes a new value when its winning class beats the current one by the configured margin,
+   a new FEN is emitted only when at least one square changed.
+4] Behind the change gate the detector only runs on the first frame after a change, so every gated frame calls
+   revote(): the last detections are voted again until the state agrees with them (settled()), which takes about
+   `window` frames for a square that held its piece for a long time.
+
+'''
+
+import chess
+import numpy as np
+
+from square_mapping import PIECE_SYMBOLS
+
+EMPTY = 0
+NUM_CLASSES = 13
+
+
+def board_from_occupancy(occupancy):
+    # chess.Board (placement only) from a 64-entry array of piece classes
+    board = chess.Board(fen="8/8/8/8/8/8/8/8 w - - 0 1")
+    for square in np.flatnonzero(occupancy):
+        board.set_piece_at(int(square), chess.Piece.from_symbol(PIECE_SYMBOLS[occupancy[square]]))
+    return board
+
+
+class FenStabilizer(object):
+
+    def __init__(self, window=5, margin=1.0, empty_confidence=0.8):
+        # A window of N frames corresponds to a decay of 1 - 1/N per frame
+        self.decay = 1.0 - 1.0 / window
+        self.margin = margin
+        self.empty_confidence = empty_confidence  # evidence added for a square without any detection
+
+        self.scores = np.zeros((64, NUM_CLASSES), dtype=np.float32)
+        self.state = None
+        self.changed = np.zeros(64, dtype=bool)
+        # Class and confidence of the last detections per square, voted again by revote()
+        self.evidence_class = None
+        self.evidence = None
+
+    def update(self, squares, pieces, confidence):
+        # Add one frame of assigned detections (squares from SquareMapper.assign), returns True when the state changed
+        evidence_class = np.zeros(64, dtype=np.intp)
+        evidence = np.full(64, self.empty_confidence, dtype=np.float32)
+        found = squares >= 0
+        evidence_class[squares[found]] = pieces[found]
+        evidence[squares[found]] = confidence[found]
+        self.evidence_class, self.evidence = evidence_class, evidence
+        return self.vote()
+
+    def vote(self):
+        evidence_class, evidence = self.evidence_class, self.evidence
+        self.scores *= self.decay
+        self.scores[np.arange(64), evidence_class] += evidence
+
+        winner = self.scores.argmax(axis=1).astype(np.int8)
+        if self.state is None:
+            self.state = winner
+            self.changed[:] = True
+            return True
+
+        # Winner must beat the current class of the square by the margin
+        current = self.scores[np.arange(64), self.state]
+        self.changed = (winner != self.state) & (self.scores.max(axis=1) - current >= self.margin)
+        self.state[self.changed] = winner[self.changed]
+        return bool(self.changed.any())
+
+    def settled(self):
+        # True when the state agrees with the last detections on every square
+        return self.state is not None and bool(np.array_equal(self.state, self.evidence_class))
+
+    def revote(self):
+        # Vote the last detections again for a frame the change gate skipped, returns True when the state changed
+        if self.evidence_class is None or self.settled():
+            return False
+        return self.vote()
+
+    def square_confidence(self):
+        # Share of the accumulated score held by the current class of every square (0-1)
+        total = np.maximum(self.scores.sum(axis=1), 1e-6)
+        return self.scores[np.arange(64), self.state] / total
+
+    def changed_squares(self):
+        return np.flatnonzero(self.changed)
+
+    def board(self):
+        return board_from_occupancy(self.state)
+
+    def fen(self):
+        return self.board().fen()
+
+    def reset(self):
+        self.scores[:] = 0
+        self.state = None
+        self.evidence_class = None
+        self.evidence = None
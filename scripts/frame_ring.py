@@ -0,0 +1,159 @@
+'''
+Code Description:
+
+1] This module shares warped board frames between the Extraction.py (producer) and Detection.py (consumer) processes.
+2] Frames live in a multiprocessing.shared_memory ring buffer of fixed-shape uint8 slots, each slot carries a sequence number
+   and the frame id of the producer, so both processes record their instrumentation spans under the same id.
+3] The consumer always takes the newest frame ("latest frame wins") as a zero-copy NumPy view and can check afterwards
+   that the producer did not overwrite the slot while it was being read (no more torn reads of a half-written board.png).
+   read_latest() copies the slot out right away (about 1.4 MB, well below a millisecond), so a detector slower than
+   the slot reuse time still works on a complete frame of its own.
+4] Shared counters keep track of frames the consumer never saw (dropped) and reads that were overwritten.
+
+'''
+
+import sys
+import time
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+# Default ring settings, frames are resized to the detector input size before writing
+DEFAULT_NAME = "chess_board_frames"
+DEFAULT_SHAPE = (680, 680, 3)
+DEFAULT_SLOTS = 4
+
+# Header layout (int64 values)
+WRITE_SEQ = 0       # sequence number of the newest complete frame
+READ_SEQ = 1        # sequence number of the last frame handed to the consumer
+DROPPED = 2         # frames written but never read
+OVERWRITTEN = 3     # reads invalidated because the producer reused the slot
+HEADER_FIELDS = 4
+
+
+class FrameRing(object):
+
+    def __init__(self, shm, shape, slots, owner):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.owner = owner
+
+        header_size = (HEADER_FIELDS + 2 * slots) * 8
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        # Sequence number stored in each slot, -1 while the slot is being written
+        self.slot_seq = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=HEADER_FIELDS * 8)
+        # Frame id of the producer (capture frame number) of each slot
+        self.slot_frame = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=(HEADER_FIELDS + slots) * 8)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=header_size)
+
+    @staticmethod
+    def _size(shape, slots):
+        return (HEADER_FIELDS + 2 * slots) * 8 + slots * int(np.prod(shape))
+
+    @classmethod
+    def create(cls, name=DEFAULT_NAME, shape=DEFAULT_SHAPE, slots=DEFAULT_SLOTS):
+        # Producer side, replaces a stale segment left behind by a crashed producer
+        size = cls._size(shape, slots)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        ring = cls(shm, shape, slots, owner=True)
+        ring.header[:] = 0
+        ring.slot_seq[:] = 0
+        ring.slot_frame[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name=DEFAULT_NAME, shape=DEFAULT_SHAPE, slots=DEFAULT_SLOTS):
+        # Consumer side, raises FileNotFoundError until the producer has created the ring
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+            # Otherwise the resource tracker unlinks the producer's segment when this process exits
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, shape, slots, owner=False)
+
+    def write(self, frame, frame_id=None):
+        # Copy one frame into the next slot, frame must already have the ring shape.
+        # frame_id is the producer's frame number, the sequence number is used when it is not given
+        seq = int(self.header[WRITE_SEQ]) + 1
+        slot = seq % self.slots
+
+        self.slot_seq[slot] = -1
+        self.frames[slot] = frame
+        self.slot_frame[slot] = seq if frame_id is None else frame_id
+        self.slot_seq[slot] = seq
+        self.header[WRITE_SEQ] = seq
+        return seq
+
+    def latest(self, last_seq=None):
+        # Newest frame as (view, seq), or (None, seq) when nothing newer than last_seq was written
+        seq = int(self.header[WRITE_SEQ])
+        if last_seq is None:
+            last_seq = int(self.header[READ_SEQ])
+        if seq == 0 or seq <= last_seq:
+            return None, last_seq
+
+        slot = seq % self.slots
+        if self.slot_seq[slot] != seq:
+            # Producer already lapped this slot, retry with the next call
+            self.header[OVERWRITTEN] += 1
+            return None, last_seq
+
+        read_seq = int(self.header[READ_SEQ])
+        if read_seq and seq > read_seq + 1:
+            self.header[DROPPED] += seq - read_seq - 1
+        self.header[READ_SEQ] = seq
+        return self.frames[slot], seq
+
+    def wait_latest(self, timeout=None, poll=0.002):
+        # Block until a frame newer than the last one read is available
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            frame, seq = self.latest()
+            if frame is not None:
+                return frame, seq
+            if deadline is not None and time.monotonic() > deadline:
+                return None, seq
+            time.sleep(poll)
+
+    def read_latest(self, timeout=None):
+        # Newest frame as (private copy, seq, producer frame id), retried when the slot was reused while it was copied
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            frame, seq = self.wait_latest(remaining)
+            if frame is None:
+                return None, seq, None
+            frame = frame.copy()
+            frame_id = int(self.slot_frame[seq % self.slots])
+            if self.valid(seq):
+                return frame, seq, frame_id
+
+    def valid(self, seq):
+        # True when the slot read for seq has not been reused since, counts the read as overwritten otherwise
+        if self.slot_seq[seq % self.slots] == seq:
+            return True
+        self.header[OVERWRITTEN] += 1
+        return False
+
+    def stats(self):
+        return {
+            "written": int(self.header[WRITE_SEQ]),
+            "read": int(self.header[READ_SEQ]),
+            "dropped": int(self.header[DROPPED]),
+            "overwritten": int(self.header[OVERWRITTEN]),
+        }
+
+    def close(self):
+        # Drop the NumPy views before closing the mapping
+        del self.header, self.slot_seq, self.slot_frame, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
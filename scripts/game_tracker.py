@@ -0,0 +1,106 @@
+'''
+Code Description:
+
+1] This module keeps the real game as a chess.Board (move history, side to move, castling and en passant rights)
+   instead of rebuilding a position from every frame.
+2] When the observed (stabilized) board differs from the tracked position, only the legal moves touching the changed
+   squares are tried. A candidate has to match the observation exactly on every square it changes, so a lifted
+   piece (from-square empty, to-square still empty) never passes as a move. The other squares are scored by how
+   many still disagree, weighted with the per-square detection confidence, which tolerates a missed detection.
+3] The best candidate is pushed when it explains the observation, so the FEN carries the correct side to move,
+   castling and en passant fields instead of a hard-coded "w - - 0 1".
+
+'''
+
+import chess
+import numpy as np
+
+from square_mapping import class_mapping
+
+# Piece symbol -> numeric class of class_mapping
+CLASS_OF_SYMBOL = {symbol: int(class_id) for class_id, symbol in class_mapping.items()}
+
+
+def board_occupancy(board):
+    # 64-entry array of piece classes (0 = empty) of a chess.Board
+    occupancy = np.zeros(64, dtype=np.int8)
+    for square, piece in board.piece_map().items():
+        occupancy[square] = CLASS_OF_SYMBOL[piece.symbol()]
+    return occupancy
+
+
+def move_squares(board, move):
+    # Every square whose content changes when the move is played
+    squares = {move.from_square, move.to_square}
+    if board.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        if chess.square_file(move.to_square) > chess.square_file(move.from_square):
+            squares |= {chess.square(7, rank), chess.square(5, rank)}
+        else:
+            squares |= {chess.square(0, rank), chess.square(3, rank)}
+    elif board.is_en_passant(move):
+        squares.add(chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square)))
+    return squares
+
+
+class GameTracker(object):
+
+    def __init__(self, fen=chess.STARTING_FEN, max_mismatch=1.0):
+        self.board = chess.Board(fen)
+        self.occupancy = board_occupancy(self.board)
+        # Highest confidence-weighted mismatch still accepted on the squares the best candidate does not touch
+        self.max_mismatch = max_mismatch
+
+    def candidates(self, changed):
+        # Legal moves that touch at least one changed square
+        changed = set(int(square) for square in changed)
+        for move in self.board.legal_moves:
+            if move_squares(self.board, move) & changed:
+                yield move
+
+    def score(self, move, observed, weight):
+        # Confidence weighted number of squares that would still disagree with the observation after the move,
+        # None when the observation disagrees on one of the squares the move changes
+        touched = list(move_squares(self.board, move))
+        self.board.push(move)
+        expected = board_occupancy(self.board)
+        self.board.pop()
+        if np.any(expected[touched] != observed[touched]):
+            return None
+        return float(weight[expected != observed].sum())
+
+    def infer_move(self, observed, confidence=None):
+        # Best legal move explaining the observed occupancy, None when the board did not change or nothing fits
+        observed = np.asarray(observed, dtype=np.int8)
+        changed = np.flatnonzero(observed != self.occupancy)
+        if changed.size == 0:
+            return None
+
+        weight = np.ones(64, dtype=np.float32) if confidence is None else np.asarray(confidence, dtype=np.float32)
+        best_move, best_score = None, None
+        for move in self.candidates(changed):
+            score = self.score(move, observed, weight)
+            if score is not None and (best_score is None or score < best_score):
+                best_move, best_score = move, score
+
+        if best_move is None or best_score > self.max_mismatch:
+            return None
+        return best_move
+
+    def observe(self, observed, confidence=None):
+        # Push the move explaining the observation, returns it (or None)
+        move = self.infer_move(observed, confidence)
+        if move is not None:
+            self.push(move)
+        return move
+
+    def push(self, move):
+        # Also used for the robot's own moves
+        self.board.push(move)
+        self.occupancy = board_occupancy(self.board)
+
+    def matches(self, observed):
+        return bool(np.array_equal(np.asarray(observed, dtype=np.int8), self.occupancy))
+
+    def fen(self):
+        return self.board.fen()
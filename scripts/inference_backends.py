@@ -0,0 +1,230 @@
+'''
+Code Description:
+
+1] This module hides where the piece and corner models run behind one small interface: backend.infer(image)[0]
+   returns a response with .predictions (x, y, width, height, confidence, class_name, class_id, detection_id)
+   and .dict(), exactly like the Roboflow models used in Detection.py and Extraction.py.
+2] RoboflowBackend wraps get_roboflow_model, the API key is read from the ROBOFLOW_API_KEY environment variable.
+3] OnnxBackend loads exported YOLO weights from disk and runs them on the CPU with ONNX Runtime (no network at startup),
+   with the thread counts and graph optimization level exposed so they can be tuned per host.
+4] The ONNX post-processor letterboxes the input, decodes YOLOv5 or YOLOv8 outputs, runs class-aware NMS and maps the
+   boxes back to the original image.
+5] infer_batch(images) runs several images (e.g. the boards of multi_board.py) in one call: one batched ONNX forward
+   pass when the model has a dynamic batch axis, one request with an image list for Roboflow.
+6] StubBackend answers without any model (fixed predictions or a function of the image, optional simulated latency),
+   it is used by benchmark.py to measure the code around the models.
+
+'''
+
+import json
+import os
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+# Default local weights, exported from the Roboflow projects
+LOCAL_MODELS = {
+    "chess-piece-detection-dwh0r/1": "../models/chess-piece-detection.onnx",
+    "chess-corner-detection/1": "../models/chess-corner-detection.onnx",
+}
+
+GRAPH_OPTIMIZATION = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+class Prediction(object):
+    # Same attributes as the Roboflow ObjectDetectionPrediction
+    def __init__(self, x, y, width, height, confidence, class_name, class_id):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.confidence = confidence
+        self.class_name = class_name
+        self.class_id = class_id
+        self.detection_id = str(uuid.uuid4())
+
+    def dict(self):
+        return {"x": self.x, "y": self.y, "width": self.width, "height": self.height,
+                "confidence": self.confidence, "class": self.class_name, "class_id": self.class_id,
+                "detection_id": self.detection_id}
+
+
+class InferenceResponse(object):
+    # Same shape as the Roboflow ObjectDetectionInferenceResponse, .dict() is what supervision reads
+    def __init__(self, predictions, width, height):
+        self.predictions = predictions
+        self.width = width
+        self.height = height
+
+    def dict(self, **kwargs):
+        return {"image": {"width": self.width, "height": self.height},
+                "predictions": [p.dict() for p in self.predictions]}
+
+
+class RoboflowBackend(object):
+
+    def __init__(self, model_id, api_key=None):
+        from inference.models.utils import get_roboflow_model
+
+        api_key = api_key or os.environ.get("ROBOFLOW_API_KEY")
+        if not api_key:
+            raise RuntimeError("Set ROBOFLOW_API_KEY or use the local ONNX backend")
+        self.model = get_roboflow_model(model_id=model_id, api_key=api_key)
+
+    def infer(self, image):
+        return self.model.infer(image)
+
+    def infer_batch(self, images):
+        # The Roboflow model takes a list of images and answers with one response per image
+        return self.model.infer(list(images))
+
+
+def letterbox(image, size):
+    # Resize keeping the aspect ratio and pad to size x size, returns (image, scale, (pad_x, pad_y))
+    height, width = image.shape[:2]
+    scale = min(size / width, size / height)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    padded = cv2.copyMakeBorder(resized, pad_y, size - new_h - pad_y, pad_x, size - new_w - pad_x,
+                                cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return padded, scale, (pad_x, pad_y)
+
+
+def decode_yolo(output, num_classes):
+    # YOLOv8 (1, 4 + nc, N) or YOLOv5 (1, N, 5 + nc) output -> (xywh, class_id, confidence)
+    output = np.squeeze(output, axis=0)
+    if output.shape[0] == 4 + num_classes and output.shape[1] != 4 + num_classes:
+        output = output.T
+        scores = output[:, 4:]
+    else:
+        scores = output[:, 5:] * output[:, 4:5]
+
+    class_id = scores.argmax(axis=1)
+    confidence = scores[np.arange(len(scores)), class_id]
+    return output[:, :4], class_id, confidence
+
+
+class OnnxBackend(object):
+
+    def __init__(self, model_path, class_names=None, input_size=640, conf_thresh=0.5, iou_thresh=0.5,
+                 max_detections=32, intra_threads=0, inter_threads=0, graph_optimization="all"):
+        if onnxruntime is None:
+            raise ImportError("onnxruntime is not installed")
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_threads
+        options.inter_op_num_threads = inter_threads
+        options.graph_optimization_level = getattr(onnxruntime.GraphOptimizationLevel, GRAPH_OPTIMIZATION[graph_optimization])
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        # Exports with a fixed batch size of 1 are run image by image in infer_batch
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        self.dynamic_batch = not isinstance(batch_dim, int)
+
+        # Class names come from the model metadata json next to the weights (e.g. ["1", "10", ...])
+        if class_names is None:
+            meta_path = os.path.splitext(model_path)[0] + ".json"
+            with open(meta_path) as json_file:
+                class_names = json.load(json_file)["class_names"]
+        self.class_names = list(class_names)
+
+        self.input_size = input_size
+        self.conf_thresh = conf_thresh
+        self.iou_thresh = iou_thresh
+        self.max_detections = max_detections
+
+    def preprocess(self, image):
+        padded, scale, pad = letterbox(image, self.input_size)
+        blob = cv2.dnn.blobFromImage(padded, scalefactor=1.0 / 255, swapRB=True)
+        return blob, scale, pad
+
+    def postprocess(self, output, scale, pad, width, height):
+        xywh, class_id, confidence = decode_yolo(output, len(self.class_names))
+        keep = confidence >= self.conf_thresh
+        xywh, class_id, confidence = xywh[keep], class_id[keep], confidence[keep]
+
+        # Undo the letterbox
+        xywh[:, 0] = (xywh[:, 0] - pad[0]) / scale
+        xywh[:, 1] = (xywh[:, 1] - pad[1]) / scale
+        xywh[:, 2:] /= scale
+
+        # Class-aware NMS on top-left based boxes
+        boxes = np.column_stack([xywh[:, 0] - xywh[:, 2] / 2, xywh[:, 1] - xywh[:, 3] / 2, xywh[:, 2], xywh[:, 3]])
+        indices = cv2.dnn.NMSBoxesBatched(boxes.tolist(), confidence.tolist(), class_id.tolist(),
+                                          self.conf_thresh, self.iou_thresh, top_k=self.max_detections)
+        indices = np.asarray(indices, dtype=int).reshape(-1)
+
+        predictions = [Prediction(float(xywh[i, 0]), float(xywh[i, 1]), float(xywh[i, 2]), float(xywh[i, 3]),
+                                  float(confidence[i]), self.class_names[class_id[i]], int(class_id[i]))
+                       for i in indices]
+        return InferenceResponse(predictions, width, height)
+
+    def infer(self, image):
+        height, width = image.shape[:2]
+        blob, scale, pad = self.preprocess(image)
+        output = self.session.run(None, {self.input_name: blob})[0]
+        return [self.postprocess(output, scale, pad, width, height)]
+
+    def infer_batch(self, images):
+        # One forward pass for all images, one response per image
+        if not self.dynamic_batch or len(images) == 1:
+            return [self.infer(image)[0] for image in images]
+        prepared = [self.preprocess(image) for image in images]
+        blob = np.concatenate([blob for blob, _, _ in prepared])
+        outputs = self.session.run(None, {self.input_name: blob})[0]
+        return [self.postprocess(outputs[i:i + 1], scale, pad, image.shape[1], image.shape[0])
+                for i, (image, (_, scale, pad)) in enumerate(zip(images, prepared))]
+
+
+class StubBackend(object):
+    # No model: predictions is a list of prediction dicts (predictions.json format) or a function image -> [Prediction]
+
+    def __init__(self, predictions=None, latency=0.0):
+        self.predictions = predictions or []
+        self.latency = latency  # seconds slept per call, stands in for the model run time
+
+    def infer(self, image, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        height, width = image.shape[:2]
+        if callable(self.predictions):
+            predictions = self.predictions(image)
+        else:
+            predictions = [Prediction(p["x"], p["y"], p["width"], p["height"], p["confidence"], p["class"],
+                                      p.get("class_id", 0)) for p in self.predictions]
+        return [InferenceResponse(predictions, width, height)]
+
+    def infer_batch(self, images):
+        # One simulated model run for the whole batch
+        if self.latency:
+            time.sleep(self.latency)
+        latency, self.latency = self.latency, 0.0
+        try:
+            return [self.infer(image)[0] for image in images]
+        finally:
+            self.latency = latency
+
+
+def load_backend(model_id, backend="roboflow", model_path=None, **kwargs):
+    # Factory used by Detection.load_model, backend is "roboflow", "onnx" or "stub"
+    if backend == "roboflow":
+        return RoboflowBackend(model_id, kwargs.get("api_key"))
+    if backend == "onnx":
+        return OnnxBackend(model_path or LOCAL_MODELS[model_id], **kwargs)
+    if backend == "stub":
+        return StubBackend(**kwargs)
+    raise ValueError("Unknown inference backend %s" % backend)
@@ -0,0 +1,164 @@
+'''
+Code Description:
+
+1] This module records how long every stage of a turn takes: capture, corner inference, warp, piece inference,
+   post-processing, localization, engine search and robot command round trips.
+2] with metrics.span("warp", frame_id): ... stores the monotonic start and the duration of the block, the frame id
+   travels with the FramePacket so the spans of one frame can be joined across stages and threads.
+3] Every stage keeps a fixed-size window of its last durations, summary() gives count / mean / p50 / p95 / p99 / max.
+4] Export: write_prometheus(path) writes a Prometheus text file (summary metrics, atomically replaced, suitable for the
+   node exporter textfile collector), open_jsonl(path) appends one JSON line per span for offline analysis.
+5] The scripts share the module level `metrics` instance, recording is a few microseconds and never blocks on I/O
+   except for the buffered JSON lines file.
+
+'''
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_WINDOW = 4096
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Span(object):
+    # Context manager timing one block, created by Metrics.span()
+    __slots__ = ("metrics", "stage", "frame_id", "start")
+
+    def __init__(self, metrics, stage, frame_id):
+        self.metrics = metrics
+        self.stage = stage
+        self.frame_id = frame_id
+
+    def __enter__(self):
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.stage, (time.monotonic_ns() - self.start) / 1e6, self.frame_id, self.start)
+        return False
+
+
+class StageTimes(object):
+    # Last `window` durations (ms) of one stage, plus totals since the start
+
+    def __init__(self, window):
+        self.samples = np.zeros(window, dtype=np.float64)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, duration):
+        self.samples[self.count % len(self.samples)] = duration
+        self.count += 1
+        self.total += duration
+
+    def window(self):
+        return self.samples[:min(self.count, len(self.samples))]
+
+
+class Metrics(object):
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.jsonl = None
+        self.exporter = None
+
+    def span(self, stage, frame_id=None):
+        return Span(self, stage, frame_id)
+
+    def record(self, stage, duration_ms, frame_id=None, start_ns=None):
+        # Add one duration, start_ns is the time.monotonic_ns() of the start when known
+        with self.lock:
+            times = self.stages.get(stage)
+            if times is None:
+                times = self.stages[stage] = StageTimes(self.window)
+            times.add(duration_ms)
+            if self.jsonl is not None:
+                self.jsonl.write(json.dumps({"stage": stage, "frame_id": frame_id, "start_ns": start_ns,
+                                             "duration_ms": round(duration_ms, 4)}) + "\n")
+
+    def summary(self):
+        # {stage: {count, mean, p50, p95, p99, max}} in ms over the window
+        with self.lock:
+            stages = {stage: (times.window().copy(), times.count, times.total) for stage, times in self.stages.items()}
+
+        summary = {}
+        for stage, (samples, count, total) in stages.items():
+            p50, p95, p99 = np.percentile(samples, [q * 100 for q in QUANTILES])
+            summary[stage] = {"count": count, "mean": total / count, "p50": p50, "p95": p95, "p99": p99,
+                              "max": float(samples.max())}
+        return summary
+
+    def report(self):
+        # Human readable table of summary()
+        lines = ["%-20s %8s %9s %9s %9s %9s" % ("stage", "count", "p50 ms", "p95 ms", "p99 ms", "max ms")]
+        for stage, s in sorted(self.summary().items()):
+            lines.append("%-20s %8i %9.2f %9.2f %9.2f %9.2f" % (stage, s["count"], s["p50"], s["p95"], s["p99"], s["max"]))
+        return "\n".join(lines)
+
+    def prometheus(self, prefix="chess_robot"):
+        # Prometheus text exposition format, one summary metric with a stage label
+        name = prefix + "_stage_duration_seconds"
+        lines = ["# HELP %s Duration of the pipeline stages" % name, "# TYPE %s summary" % name]
+        for stage, s in sorted(self.summary().items()):
+            for q in QUANTILES:
+                lines.append('%s{stage="%s",quantile="%s"} %.6f' % (name, stage, q, s["p%i" % round(q * 100)] / 1000))
+            lines.append('%s_sum{stage="%s"} %.6f' % (name, stage, s["mean"] * s["count"] / 1000))
+            lines.append('%s_count{stage="%s"} %i' % (name, stage, s["count"]))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # Write to a temporary file and rename, scrapers never see a half written file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as prom_file:
+            prom_file.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+    def open_jsonl(self, path):
+        with self.lock:
+            self.jsonl = open(path, "a", buffering=1 << 16)
+
+    def start_exporter(self, path, interval=5.0):
+        # Rewrite the Prometheus file every `interval` seconds from a background thread
+        stop_event = threading.Event()
+
+        def export():
+            while not stop_event.wait(interval):
+                self.write_prometheus(path)
+
+        self.exporter = (stop_event, path)
+        threading.Thread(target=export, name="metrics-exporter", daemon=True).start()
+
+    def close(self):
+        if self.exporter is not None:
+            stop_event, path = self.exporter
+            stop_event.set()
+            self.write_prometheus(path)
+            self.exporter = None
+        with self.lock:
+            if self.jsonl is not None:
+                self.jsonl.close()
+                self.jsonl = None
+
+
+# Shared instance used by all scripts of the process
+metrics = Metrics()
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics-prom", default=None, help="Prometheus text file rewritten every few seconds")
+    parser.add_argument("--metrics-jsonl", default=None, help="Append one JSON line per stage span to this file")
+
+
+def configure_metrics(args, interval=5.0):
+    # Set up the exports requested on the command line
+    if args.metrics_jsonl:
+        metrics.open_jsonl(args.metrics_jsonl)
+    if args.metrics_prom:
+        metrics.start_exporter(args.metrics_prom, interval)
+    return metrics
@@ -0,0 +1,228 @@
+'''
+Code Description:
+
+1] This module turns an engine move (chess.Move on the current chess.Board) into the ordered pick-and-place legs
+   the arm has to execute: capture removal to a graveyard slot, the rook leg of castling, the captured pawn of
+   en passant and the promotion piece fetched from the graveyard.
+2] Legs that do not depend on each other can run in any order and removals can use any free graveyard slot,
+   every valid ordering and the nearest slots are scored by total Cartesian travel of the arm (poses from the
+   calibration.SquareLUT), the cheapest plan is returned.
+3] Graveyard keeps track of which piece lies in which slot, so later captures use free slots and promotions
+   can fetch a captured queen (or the requested piece) back onto the board.
+4] MovePlan.waypoints() gives the move_protocol waypoints, so the whole move is sent in one frame.
+
+'''
+
+import argparse
+import itertools
+
+import chess
+import numpy as np
+
+from calibration import SquareLUT, DEFAULT_LUT_PATH
+from move_protocol import leg, FLAG_CAPTURE
+
+# Number of nearest free / matching graveyard slots tried for every removal or fetch
+SLOT_CANDIDATES = 4
+
+# Graveyard slot placeholder of a leg, resolved by the planner
+SLOT = -1
+
+
+class Leg(object):
+    # One pick-and-place: pick and place are square indices (0-63) or graveyard slots (64 + slot) in the LUT
+
+    def __init__(self, kind, pick, place, symbol):
+        self.kind = kind        # "move", "capture", "castle", "en passant", "promotion", "fetch"
+        self.pick = pick
+        self.place = place
+        self.symbol = symbol    # piece carried by the leg
+
+    def __repr__(self):
+        return "Leg(%s %s: %s -> %s)" % (self.kind, self.symbol, location_name(self.pick), location_name(self.place))
+
+
+def location_name(index):
+    if index == SLOT:
+        return "graveyard"
+    if index >= 64:
+        return "graveyard[%i]" % (index - 64)
+    return chess.square_name(index)
+
+
+class Graveyard(object):
+    # Contents of the graveyard slots beside the board (None = free)
+
+    def __init__(self, slots):
+        self.slots = [None] * slots
+
+    def free(self):
+        return [i for i, symbol in enumerate(self.slots) if symbol is None]
+
+    def holding(self, symbol):
+        return [i for i, held in enumerate(self.slots) if held == symbol]
+
+    def apply(self, plan):
+        # Update the contents after the plan was executed
+        for move_leg in plan.legs:
+            if move_leg.pick >= 64:
+                self.slots[move_leg.pick - 64] = None
+            if move_leg.place >= 64:
+                self.slots[move_leg.place - 64] = move_leg.symbol
+
+
+class MovePlan(object):
+
+    def __init__(self, move, legs, travel, flags=0, substitute=False):
+        self.move = move
+        self.legs = legs
+        self.travel = travel            # total Cartesian travel in LUT units (mm)
+        self.flags = flags
+        self.substitute = substitute    # promotion piece not in the graveyard, the pawn stands in for it
+
+    def waypoints(self, lut, safe_z):
+        waypoints = []
+        for move_leg in self.legs:
+            waypoints += leg(lut.table[move_leg.pick], lut.table[move_leg.place], safe_z)
+        return waypoints
+
+
+class MovePlanner(object):
+
+    def __init__(self, lut, graveyard=None, home=None):
+        self.lut = lut
+        self.graveyard = graveyard or Graveyard(lut.graveyard_slots)
+        # Arm position before the move (x, y, z), None ignores the travel to the first pick
+        self.home = None if home is None else np.asarray(home, dtype=np.float32)
+
+    def legs(self, board, move):
+        # Legs of the move and the ordering constraints as (before, after) leg indices.
+        # Without a spare promotion piece in the graveyard the pawn itself is placed on the promotion square
+        piece = board.piece_at(move.from_square)
+        if piece is None:
+            raise ValueError("No piece on %s for %s" % (chess.square_name(move.from_square), move.uci()))
+        legs, constraints = [], []
+
+        if board.is_castling(move):
+            rook_from, rook_to, king_to = castling_squares(board, move)
+            legs.append(Leg("move", move.from_square, king_to, piece.symbol()))
+            legs.append(Leg("castle", rook_from, rook_to, board.piece_at(rook_from).symbol()))
+            if rook_from == king_to:
+                # Chess960: the king lands where the rook stands, the rook has to go first
+                constraints.append((1, 0))
+            elif rook_to == move.from_square:
+                constraints.append((0, 1))
+            return legs, constraints
+
+        captured = None
+        if board.is_en_passant(move):
+            square = chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square))
+            captured = Leg("en passant", square, SLOT, board.piece_at(square).symbol())
+        elif board.piece_at(move.to_square) is not None:
+            captured = Leg("capture", move.to_square, SLOT, board.piece_at(move.to_square).symbol())
+
+        symbol = chess.Piece(move.promotion, piece.color).symbol() if move.promotion else None
+        if symbol is not None and self.graveyard.holding(symbol):
+            # The pawn leaves the board and the promotion piece is fetched from the graveyard
+            legs.append(Leg("promotion", move.from_square, SLOT, piece.symbol()))
+            legs.append(Leg("fetch", SLOT, move.to_square, symbol))
+        else:
+            legs.append(Leg("move", move.from_square, move.to_square, piece.symbol()))
+
+        if captured is not None:
+            legs.append(captured)
+            if captured.kind == "capture":
+                # The destination square has to be cleared before a piece is placed on it
+                constraints.append((len(legs) - 1, len(legs) - 2))
+        return legs, constraints
+
+    def plan(self, board, move):
+        legs, constraints = self.legs(board, move)
+        best = None
+        for order in itertools.permutations(range(len(legs))):
+            position = {index: i for i, index in enumerate(order)}
+            if any(position[before] > position[after] for before, after in constraints):
+                continue
+            for slots in self.slot_choices(legs):
+                ordered = [resolve(legs[i], slots.get(i)) for i in order]
+                travel = self.travel(ordered)
+                if best is None or travel < best[0]:
+                    best = (travel, ordered)
+        if best is None:
+            raise ValueError("Graveyard is full")
+
+        flags = FLAG_CAPTURE if board.is_capture(move) else 0
+        substitute = bool(move.promotion) and not any(move_leg.kind == "fetch" for move_leg in legs)
+        return MovePlan(move, best[1], best[0], flags, substitute)
+
+    def slot_choices(self, legs):
+        # Every combination of the nearest candidate slots for the legs with a graveyard end, slots used at most once
+        options = []
+        free = self.graveyard.free()
+        for i, move_leg in enumerate(legs):
+            if move_leg.place == SLOT:
+                options.append((i, "place", self.nearest(free, move_leg.pick)))
+            elif move_leg.pick == SLOT:
+                options.append((i, "pick", self.nearest(self.graveyard.holding(move_leg.symbol), move_leg.place)))
+
+        if any(not candidates for _, _, candidates in options):
+            raise ValueError("Graveyard is full")
+
+        for combination in itertools.product(*[candidates for _, _, candidates in options]):
+            if len(set(combination)) == len(combination):
+                yield {i: (end, 64 + slot) for (i, end, _), slot in zip(options, combination)}
+
+    def nearest(self, slots, square):
+        if not slots:
+            return []
+        poses = self.lut.table[64 + np.asarray(slots)]
+        distance = np.linalg.norm(poses - self.lut.table[square], axis=1)
+        return [slots[i] for i in np.argsort(distance, kind="stable")[:SLOT_CANDIDATES]]
+
+    def travel(self, legs):
+        # Arm path: (home ->) pick -> place -> next pick -> ...
+        points = [self.lut.table[index] for move_leg in legs for index in (move_leg.pick, move_leg.place)]
+        path = np.asarray(points)
+        travel = float(np.linalg.norm(np.diff(path, axis=0), axis=1).sum())
+        if self.home is not None:
+            travel += float(np.linalg.norm(path[0] - self.home))
+        return travel
+
+
+def resolve(move_leg, slot):
+    if slot is None:
+        return move_leg
+    end, index = slot
+    if end == "place":
+        return Leg(move_leg.kind, move_leg.pick, index, move_leg.symbol)
+    return Leg(move_leg.kind, index, move_leg.place, move_leg.symbol)
+
+
+def castling_squares(board, move):
+    # (rook from, rook to, king to) squares of a castling move, standard (e1g1) or king-takes-rook notation
+    rank = chess.square_rank(move.from_square)
+    kingside = board.is_kingside_castling(move)
+    if chess.square_file(move.to_square) in (2, 6) and board.piece_type_at(move.to_square) != chess.ROOK:
+        rook_file = 7 if kingside else 0
+    else:
+        rook_file = chess.square_file(move.to_square)
+    king_to = chess.square(6 if kingside else 2, rank)
+    rook_to = chess.square(5 if kingside else 3, rank)
+    return chess.square(rook_file, rank), rook_to, king_to
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan the arm legs of a chess move")
+    parser.add_argument("--lut", default=DEFAULT_LUT_PATH)
+    parser.add_argument("--fen", default=chess.STARTING_FEN)
+    parser.add_argument("--move", required=True, help="UCI move, e.g. e1g1")
+    parser.add_argument("--safe-z", type=float, default=120.0)
+    args = parser.parse_args()
+
+    lut = SquareLUT.load(args.lut)
+    board = chess.Board(args.fen)
+    plan = MovePlanner(lut).plan(board, chess.Move.from_uci(args.move))
+    for move_leg in plan.legs:
+        print(move_leg)
+    print("Travel %.0f mm, %i waypoints%s" % (plan.travel, len(plan.waypoints(lut, args.safe_z)),
+                                             ", pawn stands in for the promotion piece" if plan.substitute else ""))
@@ -0,0 +1,172 @@
+'''
+Code Description:
+
+1] This module sends a whole pick-and-place sequence to the robot program in one compact binary frame,
+   so the controller never waits for the next point (one round trip per chess move instead of one per waypoint).
+2] Frame layout (little endian), the robot program parses it with the same offsets:
+      header   "CHMV" | version u8 | flags u8 | seq u16 | count u8                  (9 bytes)
+      waypoint op u8 | gripper u8 | x f32 | y f32 | z f32                            (14 bytes each)
+      trailer  crc32 u32 of header + waypoints                                       (4 bytes)
+3] The robot answers every frame with an ack "CHAK" | seq u16 | status u8: ACCEPTED when the frame was parsed,
+   DONE after the last waypoint was executed, REJECTED for a bad frame (wrong crc or version).
+4] pick_and_place() builds the standard sequence: approach, grasp, lift, transfer, place, retreat,
+   optionally preceded by a capture-removal leg to a graveyard position.
+
+'''
+
+import struct
+import time
+import zlib
+
+from instrumentation import metrics
+
+MAGIC = b"CHMV"
+ACK_MAGIC = b"CHAK"
+VERSION = 1
+
+HEADER = struct.Struct("<4sBBHB")
+WAYPOINT = struct.Struct("<BBfff")
+TRAILER = struct.Struct("<I")
+ACK = struct.Struct("<4sHB")
+
+# Waypoint operations
+APPROACH = 1    # move above the target at safe height
+GRASP = 2       # descend to the target and close the gripper
+LIFT = 3        # rise to safe height with the piece
+TRANSFER = 4    # move above the destination at safe height
+PLACE = 5       # descend to the destination and open the gripper
+RETREAT = 6     # rise to safe height without the piece
+
+GRIPPER_OPEN = 0
+GRIPPER_CLOSED = 1
+
+# Ack status
+ACCEPTED = 0
+DONE = 1
+REJECTED = 2
+
+# Frame flags
+FLAG_CAPTURE = 1  # the plan starts with a capture-removal leg
+
+
+class Waypoint(object):
+    def __init__(self, op, x, y, z, gripper):
+        self.op = op
+        self.x = x
+        self.y = y
+        self.z = z
+        self.gripper = gripper
+
+    def __repr__(self):
+        return "Waypoint(%i, %.1f, %.1f, %.1f, %i)" % (self.op, self.x, self.y, self.z, self.gripper)
+
+
+def pick_and_place(source, destination, safe_z, capture=None, graveyard=None):
+    # Waypoints for moving a piece from source to destination (x, y, z grasp poses),
+    # with capture and graveyard given the captured piece is removed first
+    waypoints = []
+    if capture is not None:
+        waypoints += leg(capture, graveyard, safe_z)
+    waypoints += leg(source, destination, safe_z)
+    return waypoints
+
+
+def leg(source, destination, safe_z):
+    sx, sy, sz = source
+    dx, dy, dz = destination
+    return [
+        Waypoint(APPROACH, sx, sy, safe_z, GRIPPER_OPEN),
+        Waypoint(GRASP, sx, sy, sz, GRIPPER_CLOSED),
+        Waypoint(LIFT, sx, sy, safe_z, GRIPPER_CLOSED),
+        Waypoint(TRANSFER, dx, dy, safe_z, GRIPPER_CLOSED),
+        Waypoint(PLACE, dx, dy, dz, GRIPPER_OPEN),
+        Waypoint(RETREAT, dx, dy, safe_z, GRIPPER_OPEN),
+    ]
+
+
+def encode_plan(seq, waypoints, flags=0):
+    if len(waypoints) > 255:
+        raise ValueError("Too many waypoints for one frame")
+    frame = bytearray(HEADER.size + WAYPOINT.size * len(waypoints) + TRAILER.size)
+    HEADER.pack_into(frame, 0, MAGIC, VERSION, flags, seq & 0xFFFF, len(waypoints))
+    offset = HEADER.size
+    for w in waypoints:
+        WAYPOINT.pack_into(frame, offset, w.op, w.gripper, w.x, w.y, w.z)
+        offset += WAYPOINT.size
+    TRAILER.pack_into(frame, offset, zlib.crc32(memoryview(frame)[:offset]))
+    return bytes(frame)
+
+
+def decode_plan(frame):
+    # Inverse of encode_plan (what the robot program does), returns (seq, flags, waypoints)
+    magic, version, flags, seq, count = HEADER.unpack_from(frame, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a move plan frame")
+    end = HEADER.size + WAYPOINT.size * count
+    (crc,) = TRAILER.unpack_from(frame, end)
+    if crc != zlib.crc32(memoryview(frame)[:end]):
+        raise ValueError("Move plan checksum mismatch")
+    waypoints = []
+    for offset in range(HEADER.size, end, WAYPOINT.size):
+        op, gripper, x, y, z = WAYPOINT.unpack_from(frame, offset)
+        waypoints.append(Waypoint(op, x, y, z, gripper))
+    return seq, flags, waypoints
+
+
+def encode_ack(seq, status):
+    return ACK.pack(ACK_MAGIC, seq & 0xFFFF, status)
+
+
+def recv_exact(sock, buffer):
+    # Fill the whole buffer from the socket
+    view = memoryview(buffer)
+    received = 0
+    while received < len(buffer):
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Robot closed the connection")
+        received += count
+    return buffer
+
+
+class MovePlanClient(object):
+    # Python side of the protocol on the socket accepted by sockets_TFM.ConnectRobot
+
+    def __init__(self, conn, timeout=5.0):
+        self.conn = conn
+        self.timeout = timeout
+        self.seq = 0
+        self.ack = bytearray(ACK.size)
+
+    def read_ack(self, timeout):
+        self.conn.settimeout(timeout)
+        magic, seq, status = ACK.unpack(recv_exact(self.conn, self.ack))
+        if magic != ACK_MAGIC:
+            raise ConnectionError("Unexpected reply from the robot")
+        return seq, status
+
+    def send_plan(self, waypoints, flags=0):
+        # Send one plan and wait until the robot accepted it, returns its sequence number
+        self.seq = (self.seq + 1) & 0xFFFF
+        with metrics.span("robot_send_plan", self.seq):
+            self.conn.sendall(encode_plan(self.seq, waypoints, flags))
+            seq, status = self.read_ack(self.timeout)
+        if seq != self.seq or status != ACCEPTED:
+            raise ConnectionError("Robot rejected move plan %i (ack %i, status %i)" % (self.seq, seq, status))
+        return self.seq
+
+    def wait_done(self, seq, timeout=60.0):
+        # Block until the robot reports that the plan was executed
+        while True:
+            ack_seq, status = self.read_ack(timeout)
+            if ack_seq == seq and status == DONE:
+                return
+            if status == REJECTED:
+                raise ConnectionError("Robot aborted move plan %i" % ack_seq)
+
+    def execute(self, waypoints, flags=0, timeout=60.0):
+        start = time.monotonic_ns()
+        seq = self.send_plan(waypoints, flags)
+        self.wait_done(seq, timeout)
+        metrics.record("robot_execute", (time.monotonic_ns() - start) / 1e6, seq, start)
+        return seq
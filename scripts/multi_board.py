@@ -0,0 +1,315 @@
+'''
+Code Description:
+
+1] This script serves several camera/board pairs from one process: the corner and piece models are loaded once and
+   shared, instead of running Extraction.py / Detection.py / Localization_and_FEN.py once per board.
+2] Every board is a BoardSession with its own state: capture thread, homography cache, change gate, FEN stabilizer,
+   tracked game and output folder (../saved_files/<board name>/ when --debug is given).
+3] The server loop takes the newest frame of every session and batches across boards: all boards that need their
+   corners found go through the corner model in one infer_batch() call, all boards with changed squares go through
+   the piece model in one infer_batch() call.
+   With --scheduler every board runs in its own worker thread instead and the models sit behind
+   batch_scheduler.BatchScheduler, which batches whatever requests arrive within --max-delay-ms (up to --max-batch),
+   so a slow board never holds back the others.
+   With --mode tiles the boards share one tile classifier (tile_classifier.py) instead of the piece model, every
+   board keeps its own TileView cache and only its changed squares are classified. With --scheduler the tiles of
+   all boards are batched by BatchScheduler.for_tiles (up to --tile-max-batch tiles).
+   With --cpu-workers the per-board warp, change detection and resizing of the lockstep loop run in parallel on a
+   cpu_pool.CpuPool instead of one board after the other. Post-processing of the small detection arrays is mostly
+   Python work under the GIL and stays inline.
+4] Boards are given as --board name=source (camera index or video file) or a JSON config file:
+      [{"name": "left", "source": 0, "centers": "../saved_files/chessboard_centers.json", "start_fen": "..."}]
+
+'''
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import chess
+import cv2
+
+from pipeline import FramePacket, put_latest, DebugSink
+from Extraction import detect_corners, detect_corners_batch, HomographyCache, CORNER_MODEL_ID
+from Detection import load_model, detect_pieces, detect_pieces_batch, classify_tiles, PIECE_MODEL_ID, TILE_MODEL_PATH, \
+    INFERENCE_BACKEND, ONNX_THREADS
+from Localization_and_FEN import vote, chessboard_centers_path, thresh
+from square_mapping import SquareMapper
+from change_gate import ChangeGate
+from fen_stabilizer import FenStabilizer
+from tile_classifier import TileClassifier, TileView
+from game_tracker import GameTracker
+from instrumentation import metrics, add_metrics_arguments, configure_metrics
+from batch_scheduler import BatchScheduler, DEFAULT_MAX_BATCH, DEFAULT_MAX_DELAY_MS, DEFAULT_TILE_BATCH
+from cpu_pool import add_pool_arguments, create_pool
+
+
+class BoardSession(object):
+    # Everything that belongs to one camera / board pair
+
+    def __init__(self, name, source, centers_path=chessboard_centers_path, start_fen=chess.STARTING_FEN,
+                 free=False, debug_dir=None, tile_infer=None, tile=32):
+        self.name = name
+        self.source = source
+        self.mapper = SquareMapper.from_file(centers_path, thresh)
+        self.homography = HomographyCache()
+        self.gate = ChangeGate()
+        self.stabilizer = FenStabilizer()
+        self.tracker = None if free else GameTracker(start_fen)
+        self.debug_sink = DebugSink(os.path.join(debug_dir, name)) if debug_dir else None
+        # Per-board tile cache over the shared classifier (or its scheduler), None for the full-board detector
+        self.tiles = TileView(tile_infer, tile) if tile_infer is not None else None
+
+        self.frames = queue.Queue(maxsize=1)
+        self.finished = threading.Event()
+        self.frame_id = 0
+        self.fen = None
+
+    def capture(self, stop_event):
+        cap = cv2.VideoCapture(self.source)
+        while not stop_event.is_set():
+            ok, image = cap.read()
+            if not ok:
+                print("[%s] video source finished" % self.name)
+                break
+            self.frame_id += 1
+            put_latest(self.frames, FramePacket(self.frame_id, image))
+        cap.release()
+        self.finished.set()
+
+    def latest(self):
+        try:
+            return self.frames.get_nowait()
+        except queue.Empty:
+            return None
+
+    def classify(self, packet):
+        # Tile mode: classify only the changed squares of this board
+        packet.predictions, _, _ = classify_tiles(self.tiles, packet.board_image, packet.changed_squares,
+                                                  packet.frame_id)
+
+    def prepare(self, packet):
+        # Warp and change detection of a frame with a valid transform, returns the gate signature
+        with metrics.span("warp", packet.frame_id):
+            packet.board_image = self.homography.warp(packet.image)
+        packet.changed_squares, signature = self.gate.changed_squares(packet.board_image)
+        return signature
+
+    def localize(self, packet):
+        # Per-board voting and game tracking, returns True when a new FEN was produced.
+        # Gated frames come without predictions and vote the last detections again
+        with metrics.span("localization", packet.frame_id):
+            if not vote(self.stabilizer, self.mapper, packet.predictions):
+                return False
+            if self.tracker is None:
+                packet.fen = self.stabilizer.fen()
+            else:
+                packet.move = self.tracker.observe(self.stabilizer.state, self.stabilizer.square_confidence())
+                if packet.move is None:
+                    return False
+                packet.fen = self.tracker.fen()
+        self.fen = packet.fen
+        if self.debug_sink is not None:
+            self.debug_sink(packet)
+        return True
+
+
+class MultiBoardServer(object):
+
+    def __init__(self, sessions, corner_model, piece_model, on_fen=None, idle_sleep=0.005, pool=None):
+        self.sessions = sessions
+        self.corner_model = corner_model
+        self.piece_model = piece_model
+        self.on_fen = on_fen
+        self.idle_sleep = idle_sleep
+        # Optional CpuPool for the per-board OpenCV / NumPy work of step()
+        self.pool = pool
+        self.stop_event = threading.Event()
+        self.threads = [threading.Thread(target=s.capture, args=(self.stop_event,), name="capture-" + s.name, daemon=True)
+                        for s in sessions]
+
+    def step(self):
+        # One serving round over the newest frame of every board, returns the number of frames processed
+        work = [(s, p) for s, p in ((s, s.latest()) for s in self.sessions) if p is not None]
+        if not work:
+            return 0
+
+        # Corner model only for boards without a transform or with drifted corners, one call for all of them
+        need_corners = [(s, p) for s, p in work if s.homography.needs_corners(p.image)]
+        if need_corners:
+            corners = detect_corners_batch(self.corner_model, [p.image for _, p in need_corners])
+            for (session, packet), board_corners in zip(need_corners, corners):
+                session.homography.update(packet.image, board_corners)
+
+        # Warp and change gate of every board, in parallel when there is a pool
+        work = [(s, p) for s, p in work if s.homography.valid()]
+        if self.pool is not None:
+            signatures = self.pool.map(BoardSession.prepare, [s for s, _ in work], [p for _, p in work])
+        else:
+            signatures = (s.prepare(p) for s, p in work)
+        changed = []
+        for (session, packet), signature in zip(work, signatures):
+            if packet.changed_squares.size:
+                changed.append((session, packet, signature))
+            elif session.localize(packet) and self.on_fen is not None:
+                self.on_fen(session, packet)
+
+        # Tile boards classify their changed squares, the piece model runs for all other boards in one call
+        for session, packet, signature in [c for c in changed if c[0].tiles is not None]:
+            session.classify(packet)
+            session.gate.commit(signature)
+            if session.localize(packet) and self.on_fen is not None:
+                self.on_fen(session, packet)
+        changed = [c for c in changed if c[0].tiles is None]
+        if changed:
+            records, _ = detect_pieces_batch(self.piece_model, [p.board_image for _, p, _ in changed],
+                                             [p.frame_id for _, p, _ in changed], self.pool)
+            for (session, packet, signature), board_records in zip(changed, records):
+                session.gate.commit(signature)
+                packet.predictions = board_records
+                if session.localize(packet) and self.on_fen is not None:
+                    self.on_fen(session, packet)
+        return len(work)
+
+    def run(self):
+        for thread in self.threads:
+            thread.start()
+        try:
+            while not self.stop_event.is_set():
+                if self.step() == 0:
+                    if all(s.finished.is_set() and s.frames.empty() for s in self.sessions):
+                        break
+                    time.sleep(self.idle_sleep)
+        finally:
+            self.stop_event.set()
+
+    def serve_board(self, session):
+        # Worker loop of one board, the models are BatchSchedulers shared with the other workers
+        while not self.stop_event.is_set():
+            packet = session.latest()
+            if packet is None:
+                if session.finished.is_set():
+                    return
+                time.sleep(self.idle_sleep)
+                continue
+
+            if session.homography.needs_corners(packet.image):
+                session.homography.update(packet.image, detect_corners(self.corner_model, packet.image, packet.frame_id))
+            if not session.homography.valid():
+                continue
+            signature = session.prepare(packet)
+            if packet.changed_squares.size:
+                if session.tiles is not None:
+                    session.classify(packet)
+                else:
+                    packet.predictions, _, _ = detect_pieces(self.piece_model, packet.board_image, packet.frame_id)
+                session.gate.commit(signature)
+            if session.localize(packet) and self.on_fen is not None:
+                self.on_fen(session, packet)
+
+    def run_concurrent(self):
+        # One worker per board, batching is left to the schedulers wrapping the models
+        workers = [threading.Thread(target=self.serve_board, args=(s,), name="board-" + s.name, daemon=True)
+                   for s in self.sessions]
+        for thread in self.threads + workers:
+            thread.start()
+        try:
+            for thread in workers:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        finally:
+            self.stop_event.set()
+
+
+def print_board_fen(session, packet):
+    latency = time.monotonic() - packet.timestamp
+    print("[%s] frame %i FEN: %s (%.0f ms)" % (session.name, packet.frame_id, packet.fen, latency * 1000))
+
+
+def load_board_config(path):
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def parse_board(value):
+    # "name=source" -> config dict
+    name, _, source = value.partition("=")
+    return {"name": name, "source": source}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve several camera/board pairs with shared, batched models")
+    parser.add_argument("--board", action="append", type=parse_board, default=[], help="name=source, repeat per board")
+    parser.add_argument("--config", default=None, help="JSON list of boards (name, source, centers, start_fen)")
+    parser.add_argument("--free", action="store_true", help="Do not track games, emit the observed placements only")
+    parser.add_argument("--debug", default=None, help="Write board.png, predictions.bin and board.bin per board below this folder")
+    parser.add_argument("--backend", choices=["roboflow", "onnx"], default=INFERENCE_BACKEND)
+    parser.add_argument("--threads", type=int, default=ONNX_THREADS)
+    parser.add_argument("--scheduler", action="store_true", help="One worker per board, models behind a micro-batching scheduler")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="Largest batch of the scheduler")
+    parser.add_argument("--max-delay-ms", type=float, default=DEFAULT_MAX_DELAY_MS, help="Longest wait for a batch to fill")
+    parser.add_argument("--mode", choices=["board", "tiles"], default="board", help="Full-board detector or per-square tile classifier")
+    parser.add_argument("--tile-model", default=TILE_MODEL_PATH)
+    parser.add_argument("--tile-backend", choices=["opencv", "onnxruntime"], default="opencv")
+    parser.add_argument("--tile-max-batch", type=int, default=DEFAULT_TILE_BATCH, help="Largest tile batch of the scheduler (tiles, not boards)")
+    add_metrics_arguments(parser)
+    add_pool_arguments(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+    pool = create_pool(args)
+
+    boards = (load_board_config(args.config) if args.config else []) + args.board
+    if not boards:
+        parser.error("Give at least one --board name=source or a --config file")
+
+    # One instance of every model for all boards
+    corner_model = load_model(CORNER_MODEL_ID, args.backend, args.threads)
+    piece_model, classifier, tile_infer = None, None, None
+    schedulers = []
+    if args.mode == "tiles":
+        classifier = TileClassifier(args.tile_model, args.tile_backend, threads=args.threads)
+        tile_infer = classifier.infer
+        if args.scheduler:
+            tile_scheduler = BatchScheduler.for_tiles(classifier, max_batch=args.tile_max_batch,
+                                                      max_delay_ms=args.max_delay_ms, name="tiles")
+            tile_infer = tile_scheduler.call
+            schedulers.append(tile_scheduler)
+    else:
+        piece_model = load_model(PIECE_MODEL_ID, args.backend, args.threads)
+    if args.scheduler:
+        corner_model = BatchScheduler.for_model(corner_model, max_batch=args.max_batch,
+                                                max_delay_ms=args.max_delay_ms, name="corners")
+        schedulers.append(corner_model)
+        if piece_model is not None:
+            piece_model = BatchScheduler.for_model(piece_model, max_batch=args.max_batch,
+                                                   max_delay_ms=args.max_delay_ms, name="pieces")
+            schedulers.append(piece_model)
+
+    sessions = []
+    for board in boards:
+        source = board["source"]
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+        sessions.append(BoardSession(board["name"], source, board.get("centers", chessboard_centers_path),
+                                     board.get("start_fen", chess.STARTING_FEN), args.free, args.debug,
+                                     tile_infer, classifier.tile if classifier is not None else 32))
+
+    server = MultiBoardServer(sessions, corner_model, piece_model, on_fen=print_board_fen, pool=pool)
+    try:
+        if args.scheduler:
+            server.run_concurrent()
+        else:
+            server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for scheduler in schedulers:
+            print("%s: mean batch %.2f" % (scheduler.name, scheduler.mean_batch()))
+            scheduler.close()
+        if pool is not None:
+            pool.close()
+        print(metrics.report())
+        metrics.close()
@@ -0,0 +1,313 @@
+'''
+Code Description:
+
+1] This script runs the whole game in one process: perception, engine search and robot command I/O are concurrent
+   asyncio tasks instead of separate blocking scripts that only meet through board.png / predictions.json / fen.txt.
+2] Blocking work is offloaded: camera reads, the corner warp and the piece detector run in a vision thread,
+   engine searches and the robot move plan run in an I/O thread pool, so the event loop never waits on one of them.
+3] The game moves through explicit states:
+      waiting for human -> verifying move -> thinking -> executing -> verifying robot move -> waiting for human
+   a human move is only accepted when the same legal move explains the settled board for --settle seconds.
+   When the board does not show the robot move within --verify-timeout the game is paused until the pieces
+   are put on the expected squares, it never carries on from an unverified position.
+4] Inference is paused while the arm is executing (it occludes the board) and resumes once the robot reports the plan
+   done, the change gate is reset so the first frame after the retreat is always inferred.
+5] Without --robot-ip the move plans are only printed (dry run), use --engine standin to run without Stockfish.
+6] A task that fails (engine, robot connection, move plan, detector) stops the game: the error is printed with
+   the state the game was in and raised from run(), the other tasks are cancelled.
+
+'''
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+import chess.engine
+import cv2
+
+from pipeline import FramePipeline, FramePacket
+from Extraction import CORNER_MODEL_ID
+from Detection import load_model, PIECE_MODEL_ID, INFERENCE_BACKEND, ONNX_THREADS
+from Localization_and_FEN import vote
+from fen_stabilizer import FenStabilizer
+from game_tracker import GameTracker
+from engine_service import EngineService, STOCKFISH_PATH, STANDIN_ENGINE
+from calibration import SquareLUT, DEFAULT_LUT_PATH
+from move_planner import MovePlanner
+
+# Game states
+WAITING_FOR_HUMAN = "waiting for human"
+VERIFYING_MOVE = "verifying move"
+THINKING = "thinking"
+EXECUTING = "executing"
+VERIFYING_ROBOT_MOVE = "verifying robot move"
+PAUSED = "paused, board does not match the game"
+
+
+class Orchestrator(object):
+
+    def __init__(self, vision, engine, planner, robot=None, robot_color=chess.BLACK, fen=chess.STARTING_FEN,
+                 safe_z=120.0, settle=0.5, verify_timeout=5.0, retreat_delay=0.3):
+        # vision: FramePipeline (only its warp / detect / mapper are used), robot: MovePlanClient or None (dry run)
+        self.vision = vision
+        self.engine = engine
+        self.planner = planner
+        self.robot = robot
+        self.robot_color = robot_color
+        self.tracker = GameTracker(fen)
+        self.stabilizer = FenStabilizer()
+        self.safe_z = safe_z
+        self.settle = settle
+        self.verify_timeout = verify_timeout
+        self.retreat_delay = retreat_delay
+
+        self.state = None
+        # Set while the board is visible, cleared while the arm occludes it
+        self.board_visible = asyncio.Event()
+        self.board_visible.set()
+        # Set by perception whenever the stabilized board changed
+        self.board_changed = asyncio.Event()
+        self.frames = asyncio.Queue(maxsize=1)
+        self.stop_event = asyncio.Event()
+
+        # One vision thread: the homography cache and change gate are not thread safe
+        self.vision_pool = ThreadPoolExecutor(1, thread_name_prefix="vision")
+        self.capture_pool = ThreadPoolExecutor(1, thread_name_prefix="capture")
+        self.io_pool = ThreadPoolExecutor(2, thread_name_prefix="io")
+
+    def set_state(self, state):
+        if state != self.state:
+            print("[%s] %s" % (time.strftime("%H:%M:%S"), state))
+            self.state = state
+
+    async def offload(self, pool, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(pool, function, *args)
+
+    # Perception
+
+    async def capture(self, source):
+        # Keep only the newest frame, reading continues while the arm moves so the camera buffer stays fresh
+        cap = cv2.VideoCapture(source)
+        frame_id = 0
+        try:
+            while not self.stop_event.is_set():
+                ok, image = await self.offload(self.capture_pool, cap.read)
+                if not ok:
+                    print("Video source finished")
+                    self.stop_event.set()
+                    break
+                frame_id += 1
+                if self.frames.full():
+                    self.frames.get_nowait()
+                self.frames.put_nowait(FramePacket(frame_id, image))
+        finally:
+            cap.release()
+
+    def perceive(self, packet):
+        # warp -> detect in the vision thread, None when no board was found. Frames skipped by the change gate
+        # come back without predictions, the stabilizer then votes the last detections again
+        packet = self.vision.warp(packet)
+        if packet is None:
+            return None
+        return self.vision.detect(packet)
+
+    async def perception(self):
+        while not self.stop_event.is_set():
+            if not self.board_visible.is_set():
+                await self.board_visible.wait()
+                # Frames captured while the arm was in view are stale
+                while not self.frames.empty():
+                    self.frames.get_nowait()
+                continue
+
+            packet = await self.frames.get()
+            if not self.board_visible.is_set():
+                continue
+            packet = await self.offload(self.vision_pool, self.perceive, packet)
+            # The arm may have started moving while the frame was inferred
+            if packet is None or not self.board_visible.is_set():
+                continue
+            if vote(self.stabilizer, self.vision.mapper, packet.predictions):
+                self.board_changed.set()
+
+    async def board_change(self, timeout=None):
+        self.board_changed.clear()
+        try:
+            await asyncio.wait_for(self.board_changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    # Game control
+
+    async def human_move(self):
+        # WAITING_FOR_HUMAN / VERIFYING_MOVE: a legal move has to explain the board for `settle` seconds
+        self.set_state(WAITING_FOR_HUMAN)
+        candidate = None
+        while not self.stop_event.is_set():
+            changed = await self.board_change(self.settle if candidate is not None else 1.0)
+            if self.stabilizer.state is None:
+                continue
+            # A piece in the hand keeps the detections changing, only a settled board can confirm a move
+            move = None
+            if self.stabilizer.settled():
+                move = self.tracker.infer_move(self.stabilizer.state, self.stabilizer.square_confidence())
+
+            if move is None:
+                candidate = None
+                self.set_state(WAITING_FOR_HUMAN)
+            elif move != candidate or changed:
+                candidate = move
+                self.set_state(VERIFYING_MOVE)
+            else:
+                # Same move, nothing changed for `settle` seconds
+                self.tracker.push(move)
+                print("Human move: %s" % move.uci())
+                return move
+        return None
+
+    async def robot_move(self):
+        self.set_state(THINKING)
+        board = self.tracker.board.copy()
+        result = await self.offload(self.io_pool, self.engine.best_move, board)
+        if result.move is None:
+            return None
+        plan = self.planner.plan(board, result.move)
+        print("Robot move: %s (%i legs, %.0f mm)" % (result.move.uci(), len(plan.legs), plan.travel))
+
+        self.set_state(EXECUTING)
+        # The arm occludes the board, inference pauses until it retreated
+        self.board_visible.clear()
+        try:
+            await self.execute(plan)
+        finally:
+            await asyncio.sleep(self.retreat_delay)
+            self.vision.gate.reset()
+            self.board_visible.set()
+        self.planner.graveyard.apply(plan)
+        self.tracker.push(result.move)
+
+        self.set_state(VERIFYING_ROBOT_MOVE)
+        if not await self.board_matches(self.verify_timeout):
+            # Pause until the pieces are put right, the game never continues from an unverified board
+            self.set_state(PAUSED)
+            print("Board does not show %s, put the pieces as in %s" % (result.move.uci(), self.tracker.board.board_fen()))
+            if not await self.board_matches(None):
+                return None
+            self.set_state(VERIFYING_ROBOT_MOVE)
+        return result.move
+
+    async def board_matches(self, timeout):
+        # Wait until the stabilized board shows the tracked position, False on timeout or stop
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.stabilizer.state is None or not self.tracker.matches(self.stabilizer.state):
+            if self.stop_event.is_set():
+                return False
+            remaining = 1.0 if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await self.board_change(min(remaining, 1.0))
+        return True
+
+    async def execute(self, plan):
+        waypoints = plan.waypoints(self.planner.lut, self.safe_z)
+        if self.robot is None:
+            for move_leg in plan.legs:
+                print("  %s" % move_leg)
+            return
+        await self.offload(self.io_pool, self.robot.execute, waypoints, plan.flags)
+
+    async def game(self):
+        while not self.stop_event.is_set() and not self.tracker.board.is_game_over():
+            if self.tracker.board.turn == self.robot_color:
+                move = await self.robot_move()
+            else:
+                move = await self.human_move()
+            if move is None:
+                break
+        print("Game over: %s" % self.tracker.board.result())
+        self.stop_event.set()
+
+    async def run(self, source):
+        tasks = [asyncio.create_task(self.capture(source), name="capture"),
+                 asyncio.create_task(self.perception(), name="perception"),
+                 asyncio.create_task(self.game(), name="game")]
+        stop = asyncio.create_task(self.stop_event.wait())
+        try:
+            # Run until the game stops, a task that fails stops it right away instead of being dropped silently
+            pending = set(tasks) | {stop}
+            while stop in pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is not stop and not task.cancelled() and task.exception() is not None:
+                        print("%s task failed while %s: %r" % (task.get_name(), self.state, task.exception()))
+                        raise task.exception()
+        finally:
+            self.stop_event.set()
+            for task in tasks + [stop]:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for pool in (self.vision_pool, self.capture_pool, self.io_pool):
+                pool.shutdown(wait=False)
+
+
+async def connect_robot(ip, port, program, listen_ip, listen_port):
+    # Same start sequence as Arm_comms.py, the robot then connects back for the move plans
+    from rt3_async import start_program
+    from sockets_TFM import SockData, CreateSocket, ConnectRobot
+    from move_protocol import MovePlanClient
+
+    dest_socket = CreateSocket(SockData(listen_ip, listen_port))
+    client = await start_program(ip, program, port)
+    conn, _ = await asyncio.get_running_loop().run_in_executor(None, ConnectRobot, dest_socket)
+    return client, MovePlanClient(conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play a game: perception, engine and robot as concurrent tasks")
+    parser.add_argument("--source", default="0", help="Video file or camera index")
+    parser.add_argument("--backend", choices=["roboflow", "onnx"], default=INFERENCE_BACKEND)
+    parser.add_argument("--threads", type=int, default=ONNX_THREADS)
+    parser.add_argument("--engine", default=STOCKFISH_PATH, help="UCI engine executable, or 'standin'")
+    parser.add_argument("--movetime", type=float, default=0.5)
+    parser.add_argument("--robot-color", choices=["white", "black"], default="black")
+    parser.add_argument("--start-fen", default=chess.STARTING_FEN)
+    parser.add_argument("--lut", default=DEFAULT_LUT_PATH)
+    parser.add_argument("--safe-z", type=float, default=120.0)
+    parser.add_argument("--settle", type=float, default=0.5, help="Seconds a human move has to stay on the board")
+    parser.add_argument("--robot-ip", default=None, help="Controller IP, without it the plans are only printed")
+    parser.add_argument("--robot-port", type=int, default=10001)
+    parser.add_argument("--program", default="TEST")
+    parser.add_argument("--listen-ip", default="192.168.100.115")
+    parser.add_argument("--listen-port", type=int, default=10003)
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    vision = FramePipeline(source, load_model(CORNER_MODEL_ID, args.backend, args.threads),
+                           load_model(PIECE_MODEL_ID, args.backend, args.threads))
+    engine = EngineService(STANDIN_ENGINE if args.engine == "standin" else args.engine,
+                           chess.engine.Limit(time=args.movetime))
+    planner = MovePlanner(SquareLUT.load(args.lut))
+
+    async def main():
+        rt3, robot = None, None
+        if args.robot_ip:
+            rt3, robot = await connect_robot(args.robot_ip, args.robot_port, args.program,
+                                             args.listen_ip, args.listen_port)
+        orchestrator = Orchestrator(vision, engine, planner, robot,
+                                    chess.WHITE if args.robot_color == "white" else chess.BLACK,
+                                    args.start_fen, args.safe_z, args.settle)
+        try:
+            await orchestrator.run(source)
+        finally:
+            if rt3 is not None:
+                await rt3.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
@@ -0,0 +1,326 @@
+'''
+Code Description:
+
+1] This script runs the whole vision chain (capture -> corner warp -> piece detection -> FEN) inside a single process.
+2] Every stage is a thread connected to the next one by a small bounded queue, frames and predictions are passed by reference.
+3] When a queue is full the oldest packet is dropped, so a slow stage always works on the newest frame instead of falling behind.
+4] Writing board.png, predictions.bin and board.bin (state_format.py) is only done by the optional debug sink (--debug-dir).
+5] With --cpu-workers the board warp of several frames runs in parallel on a cpu_pool.CpuPool (ParallelStage),
+   the warped frames still leave the stage in capture order.
+
+'''
+
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import chess
+import cv2
+
+from Extraction import detect_corners, remap, HomographyCache, CORNER_MODEL_ID
+from Detection import load_model, detect_pieces, classify_tiles, PIECE_MODEL_ID, TILE_MODEL_PATH, INFERENCE_BACKEND, ONNX_THREADS
+from Localization_and_FEN import vote, chessboard_centers_path, thresh
+from square_mapping import SquareMapper
+from change_gate import ChangeGate
+from game_tracker import GameTracker, board_occupancy
+from state_format import write_detections, write_board
+from fen_stabilizer import FenStabilizer
+from tile_classifier import TileClassifier
+from instrumentation import metrics, add_metrics_arguments, configure_metrics
+from cpu_pool import add_pool_arguments, create_pool
+
+
+class FramePacket(object):
+    # Everything known about one camera frame while it travels through the stages
+    def __init__(self, frame_id, image):
+        self.frame_id = frame_id
+        self.timestamp = time.monotonic()
+        self.image = image
+        self.board_image = None
+        self.changed_squares = None
+        self.predictions = None
+        self.move = None
+        self.fen = None
+
+
+def put_latest(q, item):
+    # Bounded queue put that drops the oldest item instead of blocking the producer
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class Stage(threading.Thread):
+    # Worker thread applying one function to every packet of its inbox
+    def __init__(self, name, work, inbox, outbox, stop_event):
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop_event = stop_event
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                packet = self.inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            try:
+                packet = self.work(packet)
+            except Exception as e:
+                print("Error in %s stage: %s" % (self.name, e))
+                continue
+
+            # A stage returns None to drop the packet (e.g. corners not found)
+            if packet is not None and self.outbox is not None:
+                put_latest(self.outbox, packet)
+
+
+class ParallelStage(Stage):
+    # Stage whose work runs on a CpuPool for several packets at once, results leave in arrival order.
+    # submit(packet) runs on the stage thread (for state that must stay sequential) and returns a future or None
+    # to drop the packet, finish(packet, result) turns the result of the future into the outgoing packet.
+    def __init__(self, name, submit, finish, inbox, outbox, stop_event, depth):
+        super().__init__(name, None, inbox, outbox, stop_event)
+        self.submit = submit
+        self.finish = finish
+        self.depth = depth
+
+    def run(self):
+        pending = deque()
+        while not self.stop_event.is_set():
+            try:
+                packet = self.inbox.get(timeout=0.005 if pending else 0.1)
+            except queue.Empty:
+                packet = None
+
+            if packet is not None:
+                try:
+                    future = self.submit(packet)
+                except Exception as e:
+                    print("Error in %s stage: %s" % (self.name, e))
+                    future = None
+                if future is not None:
+                    pending.append((packet, future))
+
+            # Emit in order: finished heads right away, wait for the head when the pool is full or the inbox is idle
+            while pending and (pending[0][1].done() or len(pending) >= self.depth or packet is None):
+                head, future = pending.popleft()
+                try:
+                    head = self.finish(head, future.result())
+                except Exception as e:
+                    print("Error in %s stage: %s" % (self.name, e))
+                    continue
+                if head is not None and self.outbox is not None:
+                    put_latest(self.outbox, head)
+
+
+class DebugSink(object):
+    # Optional sink writing the same files as the separate scripts do
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def __call__(self, packet):
+        cv2.imwrite(os.path.join(self.folder, "board.png"), packet.board_image)
+        # A FEN completed by voting again on a gated frame has no detections of its own
+        if packet.predictions is not None:
+            write_detections(os.path.join(self.folder, "predictions.bin"), packet.predictions, packet.frame_id)
+        write_board(os.path.join(self.folder, "board.bin"), board_occupancy(chess.Board(packet.fen)), packet.fen,
+                    packet.frame_id)
+
+
+class FramePipeline(object):
+    # capture -> warp -> detect -> localize, connected by bounded in-memory queues
+
+    def __init__(self, source, corner_model, piece_model, centers_path=chessboard_centers_path,
+                 queue_size=2, on_fen=None, debug_sink=None, tile_classifier=None, tracker=None, pool=None):
+        self.source = source
+        self.corner_model = corner_model
+        self.piece_model = piece_model
+        # When given, the 64 tiles are classified instead of running the full-board detector
+        self.tile_classifier = tile_classifier
+        self.mapper = SquareMapper.from_file(centers_path, thresh)
+        self.homography = HomographyCache()
+        self.gate = ChangeGate()
+        self.stabilizer = FenStabilizer()
+        # Optional GameTracker, without it the FEN only carries the observed placement
+        self.tracker = tracker
+        self.on_fen = on_fen
+        self.debug_sink = debug_sink
+        # Optional CpuPool, the warp of several frames then runs in parallel
+        self.pool = pool
+        # Newest detections (detect stage) and the detections the stabilizer already got (localize stage).
+        # Gated packets carry the newest detections, so dropping the one inferred packet from the queue loses nothing
+        self.last_predictions = None
+        self.voted_predictions = None
+
+        self.stop_event = threading.Event()
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.boards = queue.Queue(maxsize=queue_size)
+        self.detections = queue.Queue(maxsize=queue_size)
+
+        self.threads = [
+            threading.Thread(target=self.capture, name="capture", daemon=True),
+            Stage("warp", self.warp, self.frames, self.boards, self.stop_event) if pool is None else
+            ParallelStage("warp", self.submit_warp, self.finish_warp, self.frames, self.boards, self.stop_event,
+                          pool.workers),
+            Stage("detect", self.detect, self.boards, self.detections, self.stop_event),
+            Stage("localize", self.localize, self.detections, None, self.stop_event),
+        ]
+
+    def capture(self):
+        cap = cv2.VideoCapture(self.source)
+        frame_id = 0
+        while not self.stop_event.is_set():
+            with metrics.span("capture", frame_id + 1):
+                ok, image = cap.read()
+            if not ok:
+                print("Video source finished")
+                break
+            frame_id += 1
+            put_latest(self.frames, FramePacket(frame_id, image))
+        cap.release()
+
+    def warp(self, packet):
+        # The corner model only runs while there is no transform yet or the corners drifted
+        if self.homography.needs_corners(packet.image):
+            corners = detect_corners(self.corner_model, packet.image, packet.frame_id)
+            self.homography.update(packet.image, corners)
+        if not self.homography.valid():
+            return None
+        with metrics.span("warp", packet.frame_id):
+            packet.board_image = self.homography.warp(packet.image)
+        return packet
+
+    def submit_warp(self, packet):
+        # Corner updates and the frame count stay on the stage thread, the pool remaps with a snapshot of the tables
+        if self.homography.needs_corners(packet.image):
+            corners = detect_corners(self.corner_model, packet.image, packet.frame_id)
+            self.homography.update(packet.image, corners)
+        if not self.homography.valid():
+            return None
+        return self.pool.submit(timed_warp, self.homography.take_maps(), packet.image, packet.frame_id)
+
+    def finish_warp(self, packet, board_image):
+        packet.board_image = board_image
+        return packet
+
+    def detect(self, packet):
+        # Skip the detector while no square changed since the last inferred frame, the packet still goes on
+        # with the last detections so the stabilizer can vote them again
+        with metrics.span("change_gate", packet.frame_id):
+            packet.changed_squares, signature = self.gate.changed_squares(packet.board_image)
+        if packet.changed_squares.size == 0:
+            packet.predictions = self.last_predictions
+            return packet
+        if self.tile_classifier is not None:
+            packet.predictions, _, _ = classify_tiles(self.tile_classifier, packet.board_image, packet.changed_squares,
+                                                      packet.frame_id)
+        else:
+            packet.predictions, _, _ = detect_pieces(self.piece_model, packet.board_image, packet.frame_id)
+        self.last_predictions = packet.predictions
+        self.gate.commit(signature)
+        return packet
+
+    def localize(self, packet):
+        # Only emit a FEN when the per-square vote actually changed
+        with metrics.span("localization", packet.frame_id):
+            # Detections seen before are voted again, new ones (maybe from a later gated packet) are mapped once
+            predictions = packet.predictions
+            if predictions is self.voted_predictions:
+                predictions = None
+            else:
+                self.voted_predictions = predictions
+            if not vote(self.stabilizer, self.mapper, predictions):
+                return None
+            if self.tracker is None:
+                packet.fen = self.stabilizer.fen()
+            else:
+                packet.move = self.tracker.observe(self.stabilizer.state, self.stabilizer.square_confidence())
+                if packet.move is None:
+                    return None
+                packet.fen = self.tracker.fen()
+        # Capture to FEN of the frames that changed the board
+        metrics.record("end_to_end", (time.monotonic() - packet.timestamp) * 1000, packet.frame_id)
+        if self.on_fen is not None:
+            self.on_fen(packet)
+        if self.debug_sink is not None:
+            self.debug_sink(packet)
+        return packet
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self):
+        # Wait for the capture thread, then give the stages a moment to drain
+        self.threads[0].join()
+        time.sleep(0.5)
+        self.stop()
+        for thread in self.threads[1:]:
+            thread.join()
+
+
+def timed_warp(maps, image, frame_id):
+    with metrics.span("warp", frame_id):
+        return remap(image, maps)
+
+
+def print_fen(packet):
+    latency = time.monotonic() - packet.timestamp
+    print("Frame %i FEN: %s (%.0f ms)" % (packet.frame_id, packet.fen, latency * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Single process capture -> warp -> detect -> FEN pipeline")
+    parser.add_argument("--source", default="../media/document_6064252294466113797.mp4", help="Video file or camera index")
+    parser.add_argument("--debug-dir", default=None, help="Also write board.png, predictions.bin and board.bin here")
+    parser.add_argument("--queue-size", type=int, default=2)
+    parser.add_argument("--mode", choices=["board", "tiles"], default="board", help="Full-board detector or per-square tile classifier")
+    parser.add_argument("--tile-model", default=TILE_MODEL_PATH)
+    parser.add_argument("--start-fen", default=chess.STARTING_FEN, help="Position the tracked game starts from")
+    parser.add_argument("--free", action="store_true", help="Do not track a game, emit the observed placement only")
+    parser.add_argument("--backend", choices=["roboflow", "onnx"], default=INFERENCE_BACKEND, help="Where the corner and piece models run")
+    parser.add_argument("--threads", type=int, default=ONNX_THREADS, help="ONNX Runtime intra-op threads (0 = all cores)")
+    add_metrics_arguments(parser)
+    add_pool_arguments(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+    pool = create_pool(args)
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    debug_sink = DebugSink(args.debug_dir) if args.debug_dir else None
+
+    if args.mode == "tiles":
+        piece_model, tile_classifier = None, TileClassifier(args.tile_model)
+    else:
+        piece_model, tile_classifier = load_model(PIECE_MODEL_ID, args.backend, args.threads), None
+
+    pipeline = FramePipeline(source, load_model(CORNER_MODEL_ID, args.backend, args.threads), piece_model,
+                             queue_size=args.queue_size, on_fen=print_fen, debug_sink=debug_sink,
+                             tile_classifier=tile_classifier,
+                             tracker=None if args.free else GameTracker(args.start_fen), pool=pool)
+    pipeline.start()
+    try:
+        pipeline.join()
+    except KeyboardInterrupt:
+        pipeline.stop()
+    finally:
+        if pool is not None:
+            pool.close()
+        print(metrics.report())
+        metrics.close()
@@ -0,0 +1,116 @@
+'''
+Code Description:
+
+1] This module post-processes piece detections as NumPy arrays instead of one dict per detection.
+2] The per-class centroid offsets (pieces are detected by their top, the base sits lower on the square) come from a
+   lookup table indexed by the numeric class.
+3] Class-aware NMS and the old "another prediction within 20 px" dedupe run on a vectorized IoU / distance matrix,
+   and at most max_detections boxes are kept by top-k confidence.
+4] The result is a compact structured array (DETECTION_DTYPE) that the localization code reads directly,
+   to_prediction_dicts converts it back to the old predictions.json layout for tools that still want JSON.
+
+'''
+
+import numpy as np
+
+# One record per detection, piece is the numeric class 1-12 of class_mapping
+DETECTION_DTYPE = np.dtype([
+    ("x", np.float32),
+    ("y", np.float32),
+    ("width", np.float32),
+    ("height", np.float32),
+    ("piece", np.int8),
+    ("confidence", np.float32),
+])
+
+# Centroid y offset (px on the 680 x 680 board) per class, index 0 is unused
+Y_OFFSET = np.zeros(13, dtype=np.float32)
+Y_OFFSET[[1, 3, 4, 7, 9, 10]] = 15  # bishops, knights and pawns
+Y_OFFSET[[2, 5, 8, 11]] = 25        # kings and queens
+
+
+def response_to_arrays(results):
+    # Roboflow style response -> (xywh, piece, confidence) arrays
+    predictions = results.predictions
+    count = len(predictions)
+    xywh = np.array([(p.x, p.y, p.width, p.height) for p in predictions], dtype=np.float32).reshape(count, 4)
+    piece = np.fromiter((int(p.class_name) for p in predictions), dtype=np.int8, count=count)
+    confidence = np.fromiter((p.confidence for p in predictions), dtype=np.float32, count=count)
+    return xywh, piece, confidence
+
+
+def pairwise_iou(xywh):
+    # (N, N) IoU matrix of center based boxes
+    x1 = xywh[:, 0] - xywh[:, 2] / 2
+    y1 = xywh[:, 1] - xywh[:, 3] / 2
+    x2 = xywh[:, 0] + xywh[:, 2] / 2
+    y2 = xywh[:, 1] + xywh[:, 3] / 2
+
+    inter_w = np.clip(np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]), 0, None)
+    inter_h = np.clip(np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]), 0, None)
+    inter = inter_w * inter_h
+    area = xywh[:, 2] * xywh[:, 3]
+    return inter / np.maximum(area[:, None] + area[None, :] - inter, 1e-6)
+
+
+def non_max_suppression(xywh, piece, confidence, iou_thresh=0.5, dedupe_px=20, max_detections=32):
+    # Indices of the kept detections, highest confidence first.
+    # A box is suppressed by a better box of the same class with IoU > iou_thresh, or by any better box
+    # whose center is closer than dedupe_px in x and y (the old existing_predictions check).
+    order = np.argsort(-confidence, kind="stable")
+    xywh, piece = xywh[order], piece[order]
+
+    conflict = (pairwise_iou(xywh) > iou_thresh) & (piece[:, None] == piece[None, :])
+    if dedupe_px:
+        close = np.abs(xywh[:, None, :2] - xywh[None, :, :2]) < dedupe_px
+        conflict |= close.all(axis=2)
+    # Only better (earlier) boxes can suppress
+    conflict = np.triu(conflict, k=1)
+
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1:] &= ~conflict[i, i + 1:]
+            if keep[:i + 1].sum() >= max_detections:
+                keep[i + 1:] = False
+                break
+    return order[keep]
+
+
+def postprocess(xywh, piece, confidence, conf_thresh=0.5, iou_thresh=0.5, dedupe_px=20, max_detections=32):
+    # Filter, apply the class offsets, suppress duplicates and pack the result into DETECTION_DTYPE records
+    valid = confidence >= conf_thresh
+    xywh, piece, confidence = xywh[valid], piece[valid], confidence[valid]
+
+    keep = non_max_suppression(xywh, piece, confidence, iou_thresh, dedupe_px, max_detections)
+
+    records = np.empty(len(keep), dtype=DETECTION_DTYPE)
+    records["x"] = xywh[keep, 0]
+    records["y"] = xywh[keep, 1] + Y_OFFSET[piece[keep]]
+    records["width"] = xywh[keep, 2]
+    records["height"] = xywh[keep, 3]
+    records["piece"] = piece[keep]
+    records["confidence"] = confidence[keep]
+    return records
+
+
+def records_xyxy(records):
+    # Boxes for drawing, e.g. with sv.Detections(xyxy=...)
+    half_w, half_h = records["width"] / 2, records["height"] / 2
+    return np.column_stack([records["x"] - half_w, records["y"] - half_h, records["x"] + half_w, records["y"] + half_h])
+
+
+def to_prediction_dicts(records):
+    # Records -> predictions.json layout used by Localization_and_FEN.py and check.py
+    return [{
+        "detection_id": str(i),
+        "class_name": str(int(r["piece"])),
+        "class_id": int(r["piece"]),
+        "bounding_box": {
+            "x": float(r["x"]),
+            "y": float(r["y"]),
+            "width": float(r["width"]),
+            "height": float(r["height"])
+        },
+        "confidence": float(r["confidence"])
+    } for i, r in enumerate(records)]
@@ -0,0 +1,259 @@
+'''
+Code Description:
+
+1] This module is an asyncio client for the RT Toolbox R3 protocol ("1;1;..." commands on port 10001/10002).
+2] Every command awaits its QoK / QeR reply with a per-command timeout instead of sleeping a fixed 0.5 s,
+   controller state can be polled (STATE) until a condition holds.
+   Commands are answered in order, so after a timeout the late reply would be taken as the reply of the next command:
+   the connection is marked broken instead and the next command reconnects (and reopens R3 communication first).
+   The controller does not terminate its replies, a reply is complete once the stream goes idle for idle_timeout
+   (IDLE_TIMEOUT, same framing as sockets_TFM.GetReader), a delimiter is only used for peers that send one.
+3] QeR replies are raised as typed exceptions (ProgramNotFound 4140, PermissionDenied 6020, ProcedureBug 4190),
+   the same recovery steps as comRT3_TFM.alarmHandling (reset alarm, SLOTINIT, load DUMMY) are done before raising.
+4] The command set is the same RCommands class used by comRT3_TFM.py.
+
+'''
+
+import argparse
+import asyncio
+import time
+
+from comRT3_TFM import RCommands
+from sockets_TFM import MAXBUFLEN, IDLE_TIMEOUT
+from instrumentation import metrics
+
+DEFAULT_TIMEOUT = 5.0
+
+
+class RT3Error(Exception):
+    # QeR reply or communication failure, code is the 4 digit alarm number when known
+    def __init__(self, message, code=None, reply=None):
+        super().__init__(message)
+        self.code = code
+        self.reply = reply
+
+
+class ProgramNotFound(RT3Error):
+    pass
+
+
+class PermissionDenied(RT3Error):
+    pass
+
+
+class ProcedureBug(RT3Error):
+    pass
+
+
+class RT3Timeout(RT3Error):
+    pass
+
+
+ALARMS = {
+    "4140": (ProgramNotFound, "Program not found, load all the programs to the robot"),
+    "6020": (PermissionDenied, "Permission error, make sure the robot is in AUTO mode and the TB is not on the Operation screen"),
+    "4190": (ProcedureBug, "Function procedure programming bug, restart the controller"),
+}
+
+
+def alarm_from_reply(command, reply):
+    code = reply[3:7]
+    exc_class, message = ALARMS.get(code, (RT3Error, "Controller error"))
+    return exc_class("%s (%s -> %s)" % (message, command, reply), code, reply)
+
+
+class RT3Client(object):
+
+    def __init__(self, ip, port=10001, timeout=DEFAULT_TIMEOUT, idle_timeout=IDLE_TIMEOUT, delimiter=None):
+        if delimiter is None and idle_timeout is None:
+            raise ValueError("RT3Client needs a reply delimiter or an idle timeout")
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        # Replies end when the stream goes idle, or at the delimiter (e.g. sockets_TFM.REPLY_DELIMITER) when given
+        self.idle_timeout = idle_timeout
+        self.delimiter = delimiter
+        self.commands = RCommands()
+        self.reader = None
+        self.writer = None
+        # Received bytes not yet returned as a reply (TCP may coalesce or split replies)
+        self.pending = bytearray()
+        # One command in flight at a time, replies are matched to commands in order
+        self.lock = asyncio.Lock()
+        # Set after a timeout or a lost connection, the next command reconnects
+        self.broken = False
+        # Commands replayed after a reconnect (opencom / cntlon once init_robot() ran)
+        self.session = []
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.ip, self.port), self.timeout)
+
+    async def reconnect(self):
+        # Fresh connection without any late reply of the old one, then restore the R3 session
+        await self.disconnect()
+        self.pending.clear()
+        await self.connect()
+        self.broken = False
+        for command in self.session:
+            reply = await self.exchange(command, self.timeout)
+            if reply[:3].upper() != "QOK":
+                raise alarm_from_reply(command, reply)
+
+    async def disconnect(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+    async def exchange(self, command, timeout):
+        # Write one command and read its reply, a timeout or lost connection marks the client broken
+        try:
+            self.writer.write(command.encode("utf-8"))
+            await self.writer.drain()
+            data = await self.read_reply(timeout)
+        except asyncio.TimeoutError:
+            self.broken = True
+            raise RT3Timeout("No reply to %s within %.1f s" % (command, timeout))
+        except ConnectionError:
+            self.broken = True
+            raise RT3Error("Connection closed by the controller during %s" % command)
+        return data.decode("utf-8")
+
+    async def command(self, command, timeout=None):
+        # Send one R3 command and return the payload after QoK, raise on QeR or timeout
+        timeout = self.timeout if timeout is None else timeout
+        async with self.lock:
+            if self.broken or self.writer is None:
+                await self.reconnect()
+            with metrics.span("rt3_command"):
+                reply = await self.exchange(command, timeout)
+
+        if reply[:3].upper() == "QOK":
+            return reply[3:]
+        raise alarm_from_reply(command, reply)
+
+    async def read_reply(self, timeout):
+        # Next complete reply: up to the delimiter (when given), or everything received once the stream goes idle
+        while True:
+            index = self.pending.find(self.delimiter) if self.delimiter is not None else -1
+            if index >= 0:
+                reply = bytes(self.pending[:index])
+                del self.pending[:index + len(self.delimiter)]
+                return reply
+
+            split = self.idle_timeout is not None and bool(self.pending)
+            try:
+                chunk = await asyncio.wait_for(self.reader.read(MAXBUFLEN), self.idle_timeout if split else timeout)
+            except asyncio.TimeoutError:
+                if split:
+                    reply = bytes(self.pending)
+                    self.pending.clear()
+                    return reply
+                raise
+            if not chunk:
+                raise ConnectionError("Socket closed by the controller")
+            self.pending += chunk
+
+    async def checked(self, command, timeout=None, clear_program=False):
+        # command() with the same recovery as comRT3_TFM.alarmHandling before the error is raised
+        try:
+            return await self.command(command, timeout)
+        except RT3Timeout:
+            raise
+        except RT3Error as e:
+            await self.recover(clear_program or isinstance(e, ProcedureBug))
+            raise
+
+    async def recover(self, clear_program):
+        # Reset the alarm, optionally activate program selection and load DUMMY to clear the program bug
+        try:
+            await self.command(self.commands.rstalrm)
+            if clear_program:
+                await self.command(self.commands.slotinit)
+                await self.command(self.commands.prgload + "DUMMY")
+        except RT3Error:
+            pass
+
+    async def state(self):
+        # Controller state fields of the STATE reply
+        return (await self.command("1;1;STATE")).split(";")
+
+    async def wait_for(self, predicate, timeout=10.0, interval=0.05):
+        # Poll the controller state until predicate(fields) is true, instead of sleeping a fixed time
+        deadline = time.monotonic() + timeout
+        while True:
+            fields = await self.state()
+            if predicate(fields):
+                return fields
+            if time.monotonic() > deadline:
+                raise RT3Timeout("Controller state condition not reached within %.1f s" % timeout)
+            await asyncio.sleep(interval)
+
+    async def init_robot(self):
+        # Open R3 communication, get operation rights and reset the robot
+        await self.checked(self.commands.opencom)
+        await self.checked(self.commands.cntlon)
+        self.session = [self.commands.opencom, self.commands.cntlon]
+        await self.stop_robot()
+
+    async def stop_robot(self):
+        await self.checked(self.commands.stop)
+        await self.checked(self.commands.slotinit)
+
+    async def load_program(self, program):
+        await self.checked(self.commands.loadProgram(program))
+
+    async def run_robot(self):
+        # A RUN refused for any reason other than permissions leaves the program blocked, clear it like alarmHandling
+        try:
+            await self.command(self.commands.run)
+        except PermissionDenied:
+            await self.recover(False)
+            raise
+        except RT3Timeout:
+            raise
+        except RT3Error:
+            await self.recover(True)
+            raise
+
+    async def close(self):
+        self.session = []
+        if not self.broken:
+            try:
+                await self.command(self.commands.cntloff)
+            except RT3Error:
+                pass
+        await self.disconnect()
+
+
+async def start_program(ip, program, port=10001, idle_timeout=IDLE_TIMEOUT):
+    # Same start sequence as Arm_comms.py: init, load program, run
+    client = RT3Client(ip, port, idle_timeout=idle_timeout)
+    await client.connect()
+    print("Connecting port...")
+    await client.init_robot()
+    await client.load_program(program)
+    print("Program Loaded")
+    await client.run_robot()
+    return client
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start a robot program through the R3 protocol")
+    parser.add_argument("--ip", default="192.168.100.115")
+    parser.add_argument("--port", type=int, default=10001)
+    parser.add_argument("--program", default="TEST")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT, help="Quiet time that ends a controller reply (s)")
+    args = parser.parse_args()
+
+    async def main():
+        start = time.monotonic()
+        client = await start_program(args.ip, args.program, args.port, args.idle_timeout)
+        print("Robot running after %.2f s" % (time.monotonic() - start))
+        await client.close()
+
+    asyncio.run(main())
@@ -1,8 +1,15 @@
-import socket, select, sys
+import socket, sys
 import time
+import weakref
 
 MAXBUFLEN = 512
 
+#The RT3 controller does not terminate its replies ("QoK" arrives as is), a reply is complete when
+#the stream goes quiet for IDLE_TIMEOUT. Peers that end their replies with REPLY_DELIMITER can
+#use a reader with delimiter=REPLY_DELIMITER, a terminated reply that pauses mid-send is not cut then
+REPLY_DELIMITER = b"\r"
+IDLE_TIMEOUT = 0.05
+
 class SockData(object):
     #Socket Data initialization
     def __init__(self,IP,Port):
@@ -53,45 +60,127 @@ def DataTransmission(add,sock,msg):
     #First send the data desired
     try:
         sock.sendto(msg, (add.IP,add.Port))
-        sock.settimeout(1.0)
     except Exception as e:
         print("Exception %s occured while sending data" %(e))
         sock.shutdown(socket.SHUT_RDWR)
         sock.close()
         sys.exit()
 
+class StreamReader(object):
+    #Buffered reader splitting a TCP stream into complete controller replies.
+    #Bytes are received with recv_into into one preallocated bytearray, several replies
+    #coalesced into one TCP segment or one reply split over several segments are both handled.
+    #Replies end at the delimiter and/or when the stream goes idle for idle_timeout
+
+    def __init__(self, sock, delimiter=None, size=4096, idle_timeout=IDLE_TIMEOUT):
+        if delimiter is None and idle_timeout is None:
+            raise ValueError("A reader needs a reply delimiter or an idle timeout")
+        self.sock = sock
+        self.delimiter = delimiter
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0      #first unread byte
+        self.end = 0        #end of the received bytes
+        self.idle_timeout = idle_timeout
+        self.timeout = sock.gettimeout()
+
+    def settimeout(self, timeout):
+        #Only touch the socket when the timeout really changes
+        if timeout != self.timeout:
+            self.sock.settimeout(timeout)
+            self.timeout = timeout
+
+    def _fill(self, timeout):
+        #Receive more bytes at the end of the buffer, compacting or growing it first if needed
+        if self.end == len(self.buffer):
+            if self.start > 0:
+                pending = self.end - self.start
+                self.buffer[:pending] = self.buffer[self.start:self.end]
+                self.start, self.end = 0, pending
+            else:
+                self.view.release()
+                self.buffer.extend(bytes(len(self.buffer)))
+                self.view = memoryview(self.buffer)
+
+        self.settimeout(timeout)
+        count = self.sock.recv_into(self.view[self.end:])
+        if count == 0:
+            raise ConnectionError("Socket closed by the controller")
+        self.end += count
+
+    def _next(self):
+        #(start, end) of the next complete reply in the buffer, or None
+        if self.delimiter is None:
+            return None
+        index = self.buffer.find(self.delimiter, self.start, self.end)
+        if index < 0:
+            return None
+        return self.start, index
+
+    def _consume(self, start, end, skip):
+        self.start = end + skip
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def _wait(self, timeout):
+        #Block until a reply is complete, returns its (start, end) in the buffer
+        while True:
+            found = self._next()
+            if found is not None:
+                return found[0], found[1], len(self.delimiter)
+            split = self.idle_timeout is not None and self.end > self.start
+            try:
+                self._fill(self.idle_timeout if split else timeout)
+            except socket.timeout:
+                if split:
+                    #Unterminated reply and the stream went idle: the reply is complete
+                    return self.start, self.end, 0
+                raise
+
+    def readinto(self, out, timeout=None):
+        #Copy the next reply into a caller-provided buffer (no allocation), returns its length
+        start, end, skip = self._wait(timeout)
+        length = end - start
+        out[:length] = self.view[start:end]
+        self._consume(start, end, skip)
+        return length
+
+    def read_message(self, timeout=None):
+        #Next complete reply as bytes
+        start, end, skip = self._wait(timeout)
+        message = bytes(self.view[start:end])
+        self._consume(start, end, skip)
+        return message
+
+#One StreamReader per socket, so buffered bytes survive between calls
+readers = weakref.WeakKeyDictionary()
+
+def GetReader(sock, delimiter=None, idle_timeout=IDLE_TIMEOUT):
+    #Defaults fit the RT3 controller (unterminated replies), delimiter=REPLY_DELIMITER and
+    #idle_timeout=None only for peers shown to terminate their replies
+    reader = readers.get(sock)
+    if reader is None:
+        reader = StreamReader(sock, delimiter, idle_timeout=idle_timeout)
+        readers[sock] = reader
+    return reader
+
 def RecieveData(sock):
 
-        #If no exception occurs, recieve the data
+        #If no exception occurs, recieve the data. No reply within two 2 s attempts is not fatal,
+        #an empty message is returned and the caller decides
+        reader = GetReader(sock)
         data = []
-        for retry in range(1,3):
+        for retry in range(2):
             try:
-                readable, writable, exceptional = select.select([sock], [], [], 2)
+                data = reader.read_message(timeout=2.0)
+                break
+            except socket.timeout:
+                continue
             except Exception as e:
-                print("Exception %s occured while recieving data" %(e))
+                print("Exception %s occured during recieving data" %(e))
                 sock.shutdown(socket.SHUT_RDWR)
                 sock.close()
                 sys.exit()
-            else:
-                if readable:
-                    try:
-                        data, addr = sock.recvfrom(MAXBUFLEN)
-                        sock.settimeout(500.0)
-                    except Exception as e:
-                        print("Exception %s occured during recieving data" %(e))
-                        sock.shutdown(socket.SHUT_RDWR)
-                        sock.close()
-                        sys.exit()
-                    else:
-                        break
-                else:
-                    if retry < 3:
-                        continue
-                    else:
-                        print("Socket disconnected!!!")
-                        sock.shutdown(socket.SHUT_RDWR)
-                        sock.close()
-                        sys.exit()
 
         if data:
             msg = data.decode("utf-8")
@@ -0,0 +1,151 @@
+'''
+Code Description:
+
+1] This module maps piece detections on the warped board image to chessboard squares.
+2] The 64 square centers from chessboard_centers.json are loaded once into a (64, 2) NumPy array indexed like chess.SQUARES (a1 = 0 ... h8 = 63).
+3] A whole batch of detections is assigned in one vectorized step, either to the nearest center inside the +- thresh px box
+   or by direct grid-index math on the warped board.
+4] When two detections claim the same square only the one with the higher confidence is kept.
+
+'''
+
+import json
+import numpy as np
+
+# Mapping classes to piece name
+class_mapping = {
+    "1": "b", "2": "k", "3": "n", "4": "p", "5": "q", "6": "r",
+    "7": "B", "8": "K", "9": "N", "10": "P", "11": "Q", "12": "R"
+}
+
+# Piece symbol for every numeric class (index 0 means empty square)
+PIECE_SYMBOLS = np.array([""] + [class_mapping[str(i)] for i in range(1, 13)])
+
+# Square names in chess.SQUARES order: a1, b1, ..., h8
+SQUARE_NAMES = [f + r for r in "12345678" for f in "abcdefgh"]
+SQUARE_INDEX = {name: i for i, name in enumerate(SQUARE_NAMES)}
+
+# Default threshold for prediction of piece (in pixels)
+DEFAULT_THRESH = 35
+
+
+def load_centers(file_path):
+    # Load chessboard_centers.json ({"a1": [x, y], ...}) into a (64, 2) array, NaN for missing squares
+    with open(file_path) as json_file:
+        board_centers = json.load(json_file)
+
+    centers = np.full((64, 2), np.nan, dtype=np.float32)
+    for square, coord in board_centers.items():
+        centers[SQUARE_INDEX[square]] = coord
+    return centers
+
+
+def grid_centers(size=680):
+    # (64, 2) centers of an evenly divided warped board with a8 in the top left corner (white at the bottom)
+    squares = np.arange(64)
+    cell = size / 8.0
+    return np.column_stack([(squares % 8 + 0.5) * cell, (7 - squares // 8 + 0.5) * cell]).astype(np.float32)
+
+
+def resolve_conflicts(squares, confidence):
+    # Keep only the highest-confidence detection per square, losers are set to -1
+    squares = np.asarray(squares, dtype=np.int16).copy()
+    confidence = np.asarray(confidence, dtype=np.float32)
+    valid = np.flatnonzero(squares >= 0)
+    if valid.size < 2:
+        return squares
+
+    # Sort by confidence (descending) so np.unique picks the best detection of every square first
+    order = valid[np.argsort(-confidence[valid], kind="stable")]
+    _, first = np.unique(squares[order], return_index=True)
+    keep = np.zeros(squares.shape, dtype=bool)
+    keep[order[first]] = True
+    squares[~keep] = -1
+    return squares
+
+
+class SquareMapper(object):
+    # Assigns detection centroids to square indices (-1 when no square matches)
+
+    def __init__(self, centers, thresh=DEFAULT_THRESH):
+        self.centers = np.asarray(centers, dtype=np.float32)
+        self.thresh = thresh
+
+        # Unknown centers can never win the nearest-center search
+        self._centers = np.where(np.isnan(self.centers), np.inf, self.centers)
+        self._grid = None
+
+    @classmethod
+    def from_file(cls, file_path, thresh=DEFAULT_THRESH):
+        return cls(load_centers(file_path), thresh)
+
+    def assign(self, xy, confidence=None):
+        # Nearest center inside the +- thresh px box, xy is an (N, 2) array of centroids
+        xy = np.asarray(xy, dtype=np.float32).reshape(-1, 2)
+        if xy.shape[0] == 0:
+            return np.empty(0, dtype=np.int16)
+
+        delta = np.abs(xy[:, None, :] - self._centers[None, :, :])
+        inside = (delta <= self.thresh).all(axis=2)
+        dist = np.where(inside, (delta * delta).sum(axis=2), np.inf)
+
+        squares = dist.argmin(axis=1).astype(np.int16)
+        squares[~inside.any(axis=1)] = -1
+
+        if confidence is not None:
+            squares = resolve_conflicts(squares, confidence)
+        return squares
+
+    def grid_table(self, size):
+        # Build the (8, 8) cell -> square table of a warped board of the given (width, height) from the centers
+        width, height = size
+        table = np.full((8, 8), -1, dtype=np.int16)
+        known = np.flatnonzero(~np.isnan(self.centers).any(axis=1))
+        cols = np.clip((self.centers[known, 0] * 8 / width).astype(np.int16), 0, 7)
+        rows = np.clip((self.centers[known, 1] * 8 / height).astype(np.int16), 0, 7)
+        table[rows, cols] = known
+        return table
+
+    def assign_grid(self, xy, size, confidence=None):
+        # Direct grid-index math on the warped board: cell = floor(xy / square size), no distance search
+        xy = np.asarray(xy, dtype=np.float32).reshape(-1, 2)
+        if self._grid is None or self._grid[0] != tuple(size):
+            self._grid = (tuple(size), self.grid_table(size))
+        table = self._grid[1]
+
+        width, height = size
+        cols = np.floor(xy[:, 0] * 8 / width).astype(np.int16)
+        rows = np.floor(xy[:, 1] * 8 / height).astype(np.int16)
+        on_board = (cols >= 0) & (cols < 8) & (rows >= 0) & (rows < 8)
+
+        squares = np.full(xy.shape[0], -1, dtype=np.int16)
+        squares[on_board] = table[rows[on_board], cols[on_board]]
+
+        if confidence is not None:
+            squares = resolve_conflicts(squares, confidence)
+        return squares
+
+
+def predictions_to_arrays(predictions):
+    # Convert Detection.py records (or prediction dicts from predictions.json) into (xy, piece class, confidence) arrays
+    if isinstance(predictions, np.ndarray):
+        xy = np.column_stack([predictions["x"], predictions["y"]])
+        return xy, predictions["piece"], predictions["confidence"]
+
+    count = len(predictions)
+    xy = np.empty((count, 2), dtype=np.float32)
+    pieces = np.empty(count, dtype=np.int8)
+    confidence = np.empty(count, dtype=np.float32)
+    for i, prediction in enumerate(predictions):
+        xy[i] = prediction["bounding_box"]["x"], prediction["bounding_box"]["y"]
+        pieces[i] = int(prediction["class_name"])
+        confidence[i] = prediction["confidence"]
+    return xy, pieces, confidence
+
+
+def board_array(squares, pieces):
+    # 64-entry array of piece classes (0 = empty) from the assigned squares
+    board = np.zeros(64, dtype=np.int8)
+    found = squares >= 0
+    board[squares[found]] = pieces[found]
+    return board
@@ -0,0 +1,82 @@
+'''
+Code Description:
+
+1] Minimal UCI engine used as a stand-in for Stockfish when testing engine_service.py without a compiled engine.
+2] It answers uci / isready / position / go / stop / quit and plays the legal move with the best one-ply material score
+   (captures and promotions first), reporting score, depth and a two-move pv so pondering can be exercised.
+3] Run it through engine_service.EngineService(STANDIN_ENGINE) or directly: python standin_engine.py
+
+'''
+
+import sys
+import chess
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+
+def material(board, color):
+    return sum(PIECE_VALUES[p.piece_type] * (1 if p.color == color else -1) for p in board.piece_map().values())
+
+
+def best_move(board):
+    # One-ply search on material, ties broken by move order so the answer is deterministic
+    best, best_score = None, None
+    for move in board.legal_moves:
+        board.push(move)
+        score = material(board, not board.turn)
+        if board.is_checkmate():
+            score = 100000
+        board.pop()
+        if best_score is None or score > best_score:
+            best, best_score = move, score
+    return best, best_score
+
+
+def send(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    board = chess.Board()
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+
+        if command == "uci":
+            send("id name StandIn")
+            send("id author Chess-Robot")
+            send("uciok")
+        elif command == "isready":
+            send("readyok")
+        elif command == "ucinewgame":
+            board = chess.Board()
+        elif command == "position":
+            if tokens[1] == "startpos":
+                board = chess.Board()
+                rest = tokens[2:]
+            else:
+                board = chess.Board(" ".join(tokens[2:8]))
+                rest = tokens[8:]
+            if rest and rest[0] == "moves":
+                for uci in rest[1:]:
+                    board.push_uci(uci)
+        elif command == "go":
+            move, score = best_move(board)
+            if move is None:
+                send("bestmove 0000")
+                continue
+            board.push(move)
+            reply, _ = best_move(board)
+            board.pop()
+            pv = move.uci() + (" " + reply.uci() if reply else "")
+            send("info depth 1 score cp %i pv %s" % (score - material(board, board.turn), pv))
+            send("bestmove %s%s" % (move.uci(), " ponder " + reply.uci() if reply else ""))
+        elif command == "quit":
+            break
+
+
+if __name__ == "__main__":
+    main()
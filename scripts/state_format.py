@@ -0,0 +1,216 @@
+'''
+Code Description:
+
+1] This module replaces predictions.json and fen.txt with small versioned binary files that are written once and
+   read without parsing: a fixed 32-byte header followed by fixed-size NumPy records.
+      header:      magic "CRST", format version, record kind, frame id, timestamp (time.time()), record count
+      detections:  DETECTION_DTYPE records of postprocess.py (x, y, width, height, piece class, confidence)
+      board:       frame id, timestamp, 64-byte occupancy array (piece class per square, chess.SQUARES order), FEN
+2] Every file is written to a temporary file and renamed over the old one (os.replace), so a reader sees either the
+   previous or the new state, never a half written file.
+3] Readers memory-map the file (np.memmap) and view the records in place. StateReader.poll() only maps a file again
+   after it was replaced (new inode / mtime), so a polling loop does no work while nothing changed.
+4] GameLog appends one board record per new position to an append-only log (header count 0 = records up to the end
+   of the file). A log above max_bytes is rolled over to <path>.1 ... <path>.<backups>. read_log() ignores a
+   trailing record that is still being written.
+5] python state_format.py <file> prints a file in readable form.
+
+'''
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from postprocess import DETECTION_DTYPE
+
+MAGIC = b"CRST"
+VERSION = 1
+
+KIND_DETECTIONS = 1
+KIND_BOARD = 2
+KIND_GAME_LOG = 3
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u2"),
+    ("kind", "<u2"),
+    ("frame_id", "<i8"),
+    ("timestamp", "<f8"),
+    ("count", "<u4"),
+    ("reserved", "<u4"),
+])
+
+BOARD_DTYPE = np.dtype([
+    ("frame_id", "<i8"),
+    ("timestamp", "<f8"),
+    ("occupancy", "i1", 64),
+    ("fen", "S96"),
+])
+
+RECORD_DTYPES = {KIND_DETECTIONS: DETECTION_DTYPE, KIND_BOARD: BOARD_DTYPE, KIND_GAME_LOG: BOARD_DTYPE}
+
+DETECTIONS_PATH = "../saved_files/predictions.bin"
+BOARD_PATH = "../saved_files/board.bin"
+GAME_LOG_PATH = "../saved_files/game_log.bin"
+REPLACE_RETRIES = 20
+
+
+def make_header(kind, frame_id, timestamp, count):
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header[0] = (MAGIC, VERSION, kind, frame_id or 0, time.time() if timestamp is None else timestamp, count, 0)
+    return header
+
+
+def write_atomic(path, *arrays):
+    # Write the arrays to <path>.tmp and rename it over path
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as state_file:
+        for array in arrays:
+            state_file.write(array.tobytes())
+    # On Windows the rename fails while a reader still maps the old file, try again shortly
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(0.005)
+
+
+def board_record(occupancy, fen, frame_id=None, timestamp=None):
+    record = np.zeros(1, dtype=BOARD_DTYPE)
+    record["frame_id"] = frame_id or 0
+    record["timestamp"] = time.time() if timestamp is None else timestamp
+    record["occupancy"] = occupancy
+    record["fen"] = fen.encode("ascii")
+    return record
+
+
+def write_detections(path, records, frame_id=None, timestamp=None):
+    records = np.ascontiguousarray(records, dtype=DETECTION_DTYPE)
+    write_atomic(path, make_header(KIND_DETECTIONS, frame_id, timestamp, len(records)), records)
+
+
+def write_board(path, occupancy, fen, frame_id=None, timestamp=None):
+    record = board_record(occupancy, fen, frame_id, timestamp)
+    write_atomic(path, make_header(KIND_BOARD, frame_id, record["timestamp"][0], 1), record)
+
+
+def map_state(path, kind=None):
+    # (header, records) viewed in place from a memory map of the file
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    if len(data) < HEADER_DTYPE.itemsize:
+        raise ValueError("%s is too short for a state file" % path)
+    header = data[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+    if header["magic"] != MAGIC:
+        raise ValueError("%s is not a state file" % path)
+    if header["version"] != VERSION:
+        raise ValueError("%s has format version %i, expected %i" % (path, header["version"], VERSION))
+    if kind is not None and header["kind"] != kind:
+        raise ValueError("%s holds record kind %i, expected %i" % (path, header["kind"], kind))
+
+    dtype = RECORD_DTYPES[int(header["kind"])]
+    body = data[HEADER_DTYPE.itemsize:]
+    # Game logs grow after the header was written, a partly appended record at the end is left out
+    count = int(header["count"]) if header["kind"] != KIND_GAME_LOG else len(body) // dtype.itemsize
+    return header, body[:count * dtype.itemsize].view(dtype)
+
+
+def read_detections(path=DETECTIONS_PATH):
+    # (records, frame id, timestamp), the records are a read-only view of the mapped file
+    header, records = map_state(path, KIND_DETECTIONS)
+    return records, int(header["frame_id"]), float(header["timestamp"])
+
+
+def read_board(path=BOARD_PATH):
+    # One BOARD_DTYPE record, fen() gives the FEN string
+    return map_state(path, KIND_BOARD)[1][0]
+
+
+def fen(record):
+    return record["fen"].decode("ascii")
+
+
+class StateReader(object):
+    # Polls a state file and maps it again only after it was replaced
+
+    def __init__(self, path, kind=None):
+        self.path = path
+        self.kind = kind
+        self.version = None
+
+    def poll(self):
+        # (header, records) of a new file, None while the file is missing or unchanged
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if version == self.version:
+            return None
+        state = map_state(self.path, self.kind)
+        self.version = version
+        return state
+
+
+class GameLog(object):
+    # Append-only log of board records, rolled over above max_bytes
+
+    def __init__(self, path=GAME_LOG_PATH, max_bytes=64 << 20, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.log_file = None
+        self.open()
+
+    def open(self):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.log_file = open(self.path, "ab")
+        if new:
+            self.log_file.write(make_header(KIND_GAME_LOG, 0, None, 0).tobytes())
+            self.log_file.flush()
+
+    def rollover(self):
+        self.log_file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists("%s.%i" % (self.path, i)):
+                os.replace("%s.%i" % (self.path, i), "%s.%i" % (self.path, i + 1))
+        os.replace(self.path, self.path + ".1")
+        self.open()
+
+    def append(self, occupancy, fen, frame_id=None, timestamp=None):
+        if self.log_file.tell() + BOARD_DTYPE.itemsize > self.max_bytes:
+            self.rollover()
+        # One write per record, flushed so readers see whole records
+        self.log_file.write(board_record(occupancy, fen, frame_id, timestamp).tobytes())
+        self.log_file.flush()
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+
+def read_log(path=GAME_LOG_PATH):
+    return map_state(path, KIND_GAME_LOG)[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print a binary state file (detections, board or game log)")
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    header, records = map_state(args.path)
+    print("kind %i, version %i, frame %i, %s, %i records" % (
+        header["kind"], header["version"], header["frame_id"],
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(header["timestamp"])), len(records)))
+    for record in records:
+        if header["kind"] == KIND_DETECTIONS:
+            print("piece %2i  x %6.1f  y %6.1f  w %5.1f  h %5.1f  conf %.2f" % (
+                record["piece"], record["x"], record["y"], record["width"], record["height"], record["confidence"]))
+        else:
+            print("frame %8i  %s  %s" % (record["frame_id"], time.strftime("%H:%M:%S", time.localtime(record["timestamp"])),
+                                         fen(record)))
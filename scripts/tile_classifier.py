@@ -0,0 +1,120 @@
+'''
+Code Description:
+
+1] This module is an alternative to the full-board piece detector: the warped board is cut into its 64 square tiles
+   and every tile is classified as empty or one of the 12 piece classes.
+2] The tiles are sliced with NumPy stride tricks (no Python loop) and classified as one batch by a small CPU model,
+   either with OpenCV DNN or with ONNX Runtime.
+3] Only the changed squares (see change_gate.py) have to be classified, the other squares keep their last result.
+4] The output uses the same detection records as Detection.detect_pieces, placed at the square centers,
+   so no per-class y offsets are needed.
+5] TileView holds the per-board cache, so several boards can share one classifier through
+   batch_scheduler.BatchScheduler.for_tiles: TileView(scheduler.call).
+
+'''
+
+import cv2
+import numpy as np
+
+from postprocess import DETECTION_DTYPE
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+# Model output index -> class name, 0 is the empty square, 1-12 follow class_mapping in square_mapping.py
+EMPTY = 0
+NUM_CLASSES = 13
+
+
+def square_tiles(board, tile):
+    # (64, tile, tile, C) view of the board tiles in row-major grid order (row * 8 + col)
+    side = 8 * tile
+    if board.shape[:2] != (side, side):
+        board = cv2.resize(board, (side, side), interpolation=cv2.INTER_AREA)
+    board = np.ascontiguousarray(board)
+    if board.ndim == 2:
+        board = board[:, :, None]
+
+    row_stride, col_stride, channel_stride = board.strides
+    tiles = np.lib.stride_tricks.as_strided(
+        board,
+        shape=(8, 8, tile, tile, board.shape[2]),
+        strides=(tile * row_stride, tile * col_stride, row_stride, col_stride, channel_stride),
+        writeable=False)
+    return tiles.reshape(64, tile, tile, board.shape[2])
+
+
+def softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class TileView(object):
+    # Per-board result cache over an infer function (TileClassifier.infer, or a BatchScheduler shared by several boards)
+
+    def __init__(self, infer, tile=32):
+        self.infer = infer
+        self.tile = tile
+        # Last result of every grid cell, so only changed cells need to be classified again
+        self.classes = np.zeros(64, dtype=np.int8)
+        self.confidence = np.zeros(64, dtype=np.float32)
+
+    def classify(self, board, cells=None):
+        # Classify all 64 cells (or only `cells`) of the warped board, returns the full (classes, confidence)
+        tiles = square_tiles(board, self.tile)
+        cells = np.arange(64) if cells is None else np.asarray(cells)
+        if cells.size:
+            probabilities = self.infer(tiles[cells])
+            self.classes[cells] = probabilities.argmax(axis=1)
+            self.confidence[cells] = probabilities.max(axis=1)
+        return self.classes, self.confidence
+
+
+class TileClassifier(TileView):
+
+    def __init__(self, model_path, backend="opencv", tile=32, threads=0):
+        TileView.__init__(self, self.infer, tile)
+        self.backend = backend
+
+        if backend == "opencv":
+            self.net = cv2.dnn.readNetFromONNX(model_path)
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        elif backend == "onnxruntime":
+            if onnxruntime is None:
+                raise ImportError("onnxruntime is not installed, use backend='opencv' or install onnxruntime")
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = threads
+            self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+            self.input_name = self.session.get_inputs()[0].name
+        else:
+            raise ValueError("Unknown tile classifier backend %s" % backend)
+
+    def infer(self, tiles):
+        # (N, tile, tile, 3) uint8 BGR tiles -> (N, 13) class probabilities
+        blob = cv2.dnn.blobFromImages(list(tiles), scalefactor=1.0 / 255, swapRB=True)
+        if self.backend == "opencv":
+            self.net.setInput(blob)
+            logits = self.net.forward()
+        else:
+            logits = self.session.run(None, {self.input_name: blob})[0]
+        return softmax(logits.reshape(len(tiles), NUM_CLASSES))
+
+
+def tile_predictions(classes, confidence, size=680):
+    # Detection records (postprocess.DETECTION_DTYPE) centered on the occupied cells of a size x size board
+    step = size / 8.0
+    cells = np.flatnonzero(classes != EMPTY)
+    rows, cols = np.divmod(cells, 8)
+
+    records = np.empty(len(cells), dtype=DETECTION_DTYPE)
+    records["x"] = (cols + 0.5) * step
+    records["y"] = (rows + 0.5) * step
+    records["width"] = step
+    records["height"] = step
+    records["piece"] = classes[cells]
+    records["confidence"] = confidence[cells]
+    return records
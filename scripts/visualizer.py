@@ -0,0 +1,102 @@
+'''
+Code Description:
+
+1] This module moves all cv2.imshow / cv2.waitKey calls off the processing loops into one display thread.
+2] Producers call show(window, image) which only stores the newest image of the window and returns immediately,
+   older images that were never displayed are dropped (latest-frame subscription, no queue building up).
+3] show() also accepts a function returning the image, so annotating a frame is only done for the frames
+   that are actually displayed, at most max_fps times per second.
+4] The scripts create it with create_visualizer(headless, max_fps): with --headless no thread and no window is
+   created at all (None is returned), so the loops run at full rate on machines without a display.
+
+'''
+
+import threading
+import time
+
+import cv2
+
+DEFAULT_MAX_FPS = 10.0
+
+
+class Visualizer(object):
+
+    def __init__(self, max_fps=DEFAULT_MAX_FPS):
+        self.period = 1.0 / max_fps
+        self.lock = threading.Lock()
+        self.pending = {}       # window -> image or function returning the image
+        self.updated = threading.Event()
+        self.stop_event = threading.Event()
+        self.shown = 0
+        self.dropped = 0
+        # All HighGUI calls are made from this thread only
+        self.thread = threading.Thread(target=self.run, name="visualizer", daemon=True)
+        self.thread.start()
+
+    def show(self, window, image):
+        # Never blocks, replaces the image of the window that was not displayed yet
+        if self.stop_event.is_set():
+            return
+        with self.lock:
+            if window in self.pending:
+                self.dropped += 1
+            self.pending[window] = image
+        self.updated.set()
+
+    def run(self):
+        try:
+            self.display_loop()
+        except cv2.error as e:
+            # No display (or an OpenCV build without HighGUI): keep the producers running without windows
+            print("Display not available, continuing without windows:", e)
+            self.stop_event.set()
+
+    def display_loop(self):
+        next_frame = 0.0
+        while not self.stop_event.is_set():
+            # Keep the windows responsive while waiting for new images
+            if not self.updated.wait(self.period):
+                cv2.waitKey(1)
+                continue
+
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                # Rate limit, images arriving meanwhile replace the pending ones
+                cv2.waitKey(max(1, int(delay * 1000)))
+            next_frame = time.monotonic() + self.period
+
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                self.updated.clear()
+
+            for window, image in pending.items():
+                if callable(image):
+                    # A failing annotation only costs this image, the display thread keeps running
+                    try:
+                        image = image()
+                    except Exception as e:
+                        print("Could not draw %s: %s" % (window, e))
+                        continue
+                if image is not None:
+                    cv2.imshow(window, image)
+                    self.shown += 1
+            cv2.waitKey(1)
+
+        cv2.destroyAllWindows()
+
+    def close(self):
+        self.stop_event.set()
+        self.updated.set()
+        self.thread.join(timeout=1.0)
+
+
+def create_visualizer(headless=False, max_fps=DEFAULT_MAX_FPS):
+    # None in headless mode, callers skip every display step then
+    if headless:
+        return None
+    return Visualizer(max_fps)
+
+
+def add_visualizer_arguments(parser):
+    parser.add_argument("--headless", action="store_true", help="No windows, no display thread (servers without a display)")
+    parser.add_argument("--display-fps", type=float, default=DEFAULT_MAX_FPS, help="Maximum display refresh rate")
@@ -0,0 +1,46 @@
+import chess
+import numpy as np
+
+from game_tracker import GameTracker, board_occupancy
+
+
+def observed_after(*moves, empty=()):
+    board = chess.Board()
+    for move in moves:
+        board.push_uci(move)
+    occupancy = board_occupancy(board)
+    occupancy[list(empty)] = 0
+    return occupancy
+
+
+def test_played_move_is_found():
+    tracker = GameTracker()
+    assert tracker.observe(observed_after("e2e4")) == chess.Move.from_uci("e2e4")
+    assert tracker.board.turn == chess.BLACK
+
+
+def test_lifted_pawn_is_not_a_move():
+    tracker = GameTracker()
+    confidence = np.full(64, 0.9, dtype=np.float32)
+    assert tracker.observe(observed_after(empty=[chess.E2]), confidence) is None
+    assert tracker.board.fen() == chess.STARTING_FEN
+
+
+def test_lifted_knight_is_not_a_move():
+    tracker = GameTracker()
+    assert tracker.observe(observed_after(empty=[chess.G1])) is None
+    # The real move still fits once the knight is put down
+    assert tracker.observe(observed_after("g1f3")) == chess.Move.from_uci("g1f3")
+
+
+def test_missed_detection_off_the_move_is_tolerated():
+    tracker = GameTracker()
+    confidence = np.full(64, 0.9, dtype=np.float32)
+    observed = observed_after("e2e4", empty=[chess.A1])
+    assert tracker.observe(observed, confidence) == chess.Move.from_uci("e2e4")
+
+
+def test_missed_detection_on_the_move_waits():
+    tracker = GameTracker()
+    assert tracker.observe(observed_after("e2e4", empty=[chess.E4])) is None
+    assert tracker.board.fen() == chess.STARTING_FEN
@@ -0,0 +1,63 @@
+import chess
+import numpy as np
+
+from board_renderer import BoardRenderer
+from change_gate import ChangeGate
+from fen_stabilizer import FenStabilizer
+from game_tracker import GameTracker, board_occupancy
+from Localization_and_FEN import vote
+from postprocess import DETECTION_DTYPE
+from square_mapping import SquareMapper, grid_centers
+
+
+def detections(mapper, board):
+    # Perfect detector: one record on the center of every occupied square
+    occupancy = board_occupancy(board)
+    squares = np.flatnonzero(occupancy)
+    records = np.zeros(len(squares), dtype=DETECTION_DTYPE)
+    records["x"], records["y"] = mapper.centers[squares, 0], mapper.centers[squares, 1]
+    records["piece"] = occupancy[squares]
+    records["confidence"] = 0.9
+    return records
+
+
+def play(frames, tmp_path):
+    # Same flow as FramePipeline.detect / localize: the detector only runs when the gate lets a frame through
+    renderer = BoardRenderer(680, atlas_path=str(tmp_path / "atlas_%i.npy"))
+    mapper = SquareMapper(grid_centers(680), 35)
+    gate, stabilizer, tracker = ChangeGate(), FenStabilizer(), GameTracker()
+    inferred = 0
+    for board in frames:
+        image = renderer.render(board).copy()
+        changed, signature = gate.changed_squares(image)
+        predictions = None
+        if changed.size:
+            predictions = detections(mapper, board)
+            gate.commit(signature)
+            inferred += 1
+        if vote(stabilizer, mapper, predictions):
+            tracker.observe(stabilizer.state, stabilizer.square_confidence())
+    return tracker, inferred
+
+
+def test_move_behind_gate_changes_fen(tmp_path):
+    start = chess.Board()
+    moved = chess.Board()
+    moved.push_uci("e2e4")
+    tracker, inferred = play([start] * 10 + [moved] * 10, tmp_path)
+
+    assert inferred == 2
+    assert tracker.fen() == moved.fen()
+
+
+def test_stabilizer_settles_and_stops_voting():
+    stabilizer = FenStabilizer()
+    squares = np.array([12], dtype=np.intp)
+    pieces = np.array([10], dtype=np.int8)
+    confidence = np.array([0.9], dtype=np.float32)
+    stabilizer.update(squares, pieces, confidence)
+
+    assert stabilizer.settled()
+    scores = stabilizer.scores.copy()
+    assert not stabilizer.revote()
+    assert np.array_equal(scores, stabilizer.scores)